@@ -1,49 +1,26 @@
 import os
-import copy
+import sys
 import bisect
+import concurrent.futures
 import numpy as np
 import matplotlib as mpl
 import scipy.signal
+import scipy.sparse
+import scipy.sparse.linalg
 import matplotlib.pyplot as plt
 
+# The operator helpers shared with the other SpinSystem scripts live in the
+# repository root, one level up from this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from SpinOperators import (generate_spin_matrices, expand_with_identities,
+                           add_kron_identity, add_pair_kron_identity,
+                           apply_kron_identity, apply_pair_kron_identity,
+                           sparse_kron_identity, sparse_pair_kron_identity)
+
 mpl.rcParams["savefig.directory"] = "."
 np.set_printoptions(precision=7, edgeitems=30, linewidth=100000)
 mpl.rcParams.update({'font.size': 24})
 
-def generate_spin_matrices(spin):
-    """ Generates the x, y, z spin matrices for an arbitrary spin"""
-    if spin == 0:
-        return np.array((0,)), np.array((0,)), np.array((0,))
-
-    # Dimension of spin matrices of a given spin
-    dim = int(2 * spin + 1)
-    # Generates a descending list from spin to -spin in steps of -1
-    desc = np.arange(spin, -spin-1, -1)
-
-    # Create a template for the spin matrices
-    sx = np.zeros((dim, dim), dtype=complex)
-    sy = np.zeros((dim, dim), dtype=complex)
-    sz = np.zeros((dim, dim), dtype=complex)
-
-    # Generate the spin matrices using the formula
-    # http://easyspin.org/documentation/spinoperators.html
-    for row in range(dim):
-        sz[row, row] = desc[row]
-
-        if row == 0:
-            sx[row, row+1] = 1/2*np.sqrt(spin*(spin+1)-desc[row]*desc[row+1])
-            sy[row, row+1] = -(1j/2)*np.sqrt(spin*(spin+1)-desc[row]*desc[row+1])
-        elif row == dim-1:
-            sx[row, row-1] = 1/2*np.sqrt(spin*(spin+1)-desc[row]*desc[row-1])
-            sy[row, row-1] = (1j/2)*np.sqrt(spin*(spin+1)-desc[row]*desc[row-1])
-        else:
-            sx[row, row+1] = 1/2*np.sqrt(spin*(spin+1)-desc[row]*desc[row+1])
-            sx[row, row-1] = 1/2*np.sqrt(spin*(spin+1)-desc[row]*desc[row-1])
-            sy[row, row+1] = -(1j/2)*np.sqrt(spin*(spin+1)-desc[row]*desc[row+1])
-            sy[row, row-1] = (1j/2)*np.sqrt(spin*(spin+1)-desc[row]*desc[row-1])
-
-    return sx, sy, sz
-
 class Neighbour:
     def __init__(self, disp_vector, spinH, g_n_host, element):
         self.disp_vector = 10**-10 * np.array(disp_vector)
@@ -74,11 +51,18 @@ class SpinSystem:
     def set_vector(self, disp_vector):
         self.__init__(self.spinS, self.spinI, self.g_gs, self.g_es, self.A_gs, self.A_es, self.g_n_rei, self.g_n_host, self.spinH, disp_vector)
 
-    def __init__(self, spinS, spinI, g_gs, g_es, A_gs, A_es, g_n_rei, neighbours_list):
+    def __init__(self, spinS, spinI, g_gs, g_es, A_gs, A_es, g_n_rei, neighbours_list, dtype=complex, dense=True):
         # spinS = Electron spin, spinI = Nuclear spin, spinH = Nuclear spin of host atom
         self.spinS = spinS
         self.spinI = spinI
 
+        # Precision of the Hamiltonians and operators. np.complex64 halves the
+        # memory needed for large baths and still resolves the superhyperfine
+        # levels to within ~20 Hz of the complex128 ones.
+        self.dtype = dtype
+        # Matching real precision for B fields and energies
+        self.real_dtype = np.finfo(dtype).dtype
+
         # gs = ground state, es = excited state
         # g = electronic zeeman coefficients (3x3 matrix)
         # g_n = REI Nuclear g coefficient (isotropic)
@@ -112,42 +96,78 @@ class SpinSystem:
         self.neighbours = [Neighbour(*neigh) for neigh in self.neighbours_input]
         self.neighbours_string = "".join([neigh.element for neigh in self.neighbours])
 
-        # Hamiltonian currently consists of only the hyperfine and SHF pieces 
-        # since they are independent of the B field.
+        # Dimensions of each subsystem in the order they appear in the tensor
+        # product: electron, REI nucleus, then each host nucleus.
+        self.dims = [self.multS, self.multI] + [neigh.multH for neigh in self.neighbours]
+        # Total dimension D of the tensor product space
+        self.dim = int(np.prod(self.dims))
+
+        # Local blocks of every term, i.e. the operators on just the one or
+        # two subsystems they act on. The hyperfine and SHF pieces are 
+        # independent of the B field, and the Zeeman terms are linear in B so
+        # their x, y, z components only need to be built once and can be 
+        # reused for every value of B.
         self.initialize_HHF()
         self.initialize_SHF()
-        self.reset_ham()
-
-        # # Update list of energy levels for each state
-        self.calc_energies()
+        self.initialize_zeeman_basis()
+        # Sparse versions for the Lanczos solver used on large baths are only
+        # built the first time they are needed
+        self.sparse_initialized = False
+
+        # The full D x D matrices are needed for everything except the sparse
+        # and matrix free Lanczos paths. With dense=False they are skipped so
+        # that very large baths only ever hold the local blocks.
+        self.dense = dense
+        if self.dense:
+            self.initialize_dense_operators()
+            self.reset_ham()
+            # # Update list of energy levels for each state
+            self.calc_energies()
+
+    def check_dense(self):
+        """ Raises an exception if the full D x D operators needed by the 
+        dense methods were skipped with dense=False. """
+        if not self.dense:
+            raise Exception("Dense operators were not built (dense=False), use the sparse or matrix free methods")
 
     def reset_ham(self):
         """ Sets the Hamiltonian to consist of only the field independent hyperfine 
         and superhyperfine parts. """
 
-        self.H_gs = copy.deepcopy(self.HHF_gs + self.H_SHF_gs)
-        self.H_es = copy.deepcopy(self.HHF_es + self.H_SHF_es)
+        self.check_dense()
+        np.copyto(self.H_gs, self.H0_gs)
+        np.copyto(self.H_es, self.H0_es)
+
+    def subsystem_dims(self, k):
+        """ Returns the total dimensions of the subsystems to the left and to
+        the right of the k-th subsystem in the tensor product. """
+        return int(np.prod(self.dims[:k])), int(np.prod(self.dims[k+1:]))
 
     def initialize_HHF(self):
         # Compute the hyperfine Hamiltonian by I @ A @ S for the ground state
         # Reshape S from a column matrix of 3 multS x multS matrices to become 3 rows and multS^2 columns
         # This lets to dot with A which is a 3x3 matrix. We then immediately reshape back.
         # Then we take the dot product with I by kronecker product componentwise and sum.
-        self.HHF_gs = (self.A_gs @ self.Sv3).reshape((3, self.multS, self.multS))
-        # self.HHF_gs = sum(np.kron(self.I[i], self.HHF_gs[i]) for i in range(3))
-        self.HHF_gs = sum(self.S[i] @ self.HHF_gs[i] for i in range(3))
-        # Used HHF to represent the quadrupole interaction instead (TODO)
-
-        # Expand into the host nucleus space
-        for neigh in self.neighbours: 
-            self.HHF_gs = np.kron(self.HHF_gs, np.identity(neigh.multH))
+        # If the interaction is switched off (A is all zero) we skip building it
+        # and HHF is set to None.
+        # Only the block on the electron and REI nucleus is stored here, the
+        # expansion into the host nucleus space is done where it is needed.
+        if np.any(self.A_gs):
+            HHF_gs = (self.A_gs @ self.Sv3).reshape((3, self.multS, self.multS))
+            # HHF_gs = sum(np.kron(self.I[i], HHF_gs[i]) for i in range(3))
+            HHF_gs = sum(self.S[i] @ HHF_gs[i] for i in range(3))
+            # Used HHF to represent the quadrupole interaction instead (TODO)
+            self.HHF_gs_local = HHF_gs.astype(self.dtype)
+        else:
+            self.HHF_gs_local = None
 
         # Repeat for the excited state
-        self.HHF_es = (self.A_es @ self.Sv3).reshape((3, self.multS, self.multS))
-        self.HHF_es = sum(np.kron(self.I[i], self.HHF_es[i]) for i in range(3))
-        # Expand into the host nucleus space
-        for neigh in self.neighbours: 
-            self.HHF_es = np.kron(self.HHF_es, np.identity(neigh.multH))
+        if np.any(self.A_es):
+            HHF_es = (self.A_es @ self.Sv3).reshape((3, self.multS, self.multS))
+            HHF_es = sum(np.kron(self.I[i], HHF_es[i]) for i in range(3))
+            self.HHF_es_local = HHF_es.astype(self.dtype)
+        else:
+            self.HHF_es_local = None
 
     def initialize_SHF(self):
         # mu = mu_b * g * S
@@ -155,111 +175,227 @@ class SpinSystem:
         # Then reshape so that we get back our column 3 x (multS x multS) 
         mu_REI_gs = -(self.mu_b * self.g_gs @ self.Sv3).reshape((3, self.multS, self.multS)) 
         mu_REI_es = -(self.mu_b * self.g_es @ self.Sv3).reshape((3, self.multS, self.multS))
-        # Reshape both back to v3 since we need another dot product, this time with R
-        mu_REI_gs_v3 = mu_REI_gs.reshape((3, self.multS**2))
-        mu_REI_es_v3 = mu_REI_es.reshape((3, self.multS**2))
 
-        # First term is (mu_REI)dot(mu_host)/R^3
-        first_term_gs = 0
-        first_term_es = 0
-        # Second term is 3(mu_REI dot R)(mu_host dot R)/R^5
-        second_term_gs = 0
-        second_term_es = 0
+        # Divide by the constant factor to convert from J to GHz
+        # First 10**-7 comes from mu0/4pi
+        to_GHz = 10**-7 / (self.h * 10**9)
+        # (coeffs, mid_dim, right_dim) of every pair term, already in GHz
+        self.SHF_gs_local = []
+        self.SHF_es_local = []
 
         for neigh_idx, neigh in enumerate(self.neighbours):
 
             mu_host = self.mu_n * neigh.g_n_host * neigh.H
-            # Reshape back to v3 since we need another dot product later with R
-            mu_host_v3 = mu_host.reshape((3, neigh.multH**2))
 
-            # Do the dot product of mu_REI dot mu_host but with intervening identities
-            # for the REI nuclear space + spectator host nuclei
+            # The interaction is mu_REI @ D @ mu_host with the dipole-dipole tensor
+            # D = I/R^3 - 3(R R^T)/R^5, i.e. the first term is (mu_REI)dot(mu_host)/R^3
+            # and the second term is 3(mu_REI dot R)(mu_host dot R)/R^5
+            dipole = np.identity(3) / neigh.R**3 - 3 * np.outer(neigh.disp_vector, neigh.disp_vector) / neigh.R**5
+
+            # Contract the 3 components to get the coefficients of the 
+            # multS x multS x multH x multH pair operator of the REI and host
+            coeffs_gs = np.einsum('ab,aij,bkl->ijkl', dipole, mu_REI_gs, mu_host, optimize=True)
+            coeffs_es = np.einsum('ab,aij,bkl->ijkl', dipole, mu_REI_es, mu_host, optimize=True)
+
+            # Dimensions of the REI nuclear space + spectator host nuclei 
+            # between the REI and this host, and of the hosts after it
+            before_dim = int(np.prod(self.dims[1:2+neigh_idx]))
+            after_dim = self.subsystem_dims(2 + neigh_idx)[1]
+            self.SHF_gs_local.append(((to_GHz * coeffs_gs).astype(self.dtype), before_dim, after_dim))
+            self.SHF_es_local.append(((to_GHz * coeffs_es).astype(self.dtype), before_dim, after_dim))
+
+    def initialize_zeeman_basis(self):
+        """ Computes the x, y, z components of the Zeeman operators such that 
+        the Zeeman Hamiltonian is just the dot product of B with them, up to 
+        the factors of beta_el and beta_n. Only the local blocks on the 
+        subsystem each term acts on are stored here. """
+
+        # Compute the electronic Zeeman operators g @ S for each component
+        self.O_el_gs_local = (self.g_gs @ self.Sv3).reshape((3, self.multS, self.multS)).astype(self.dtype)
+        self.O_el_es_local = (self.g_es @ self.Sv3).reshape((3, self.multS, self.multS)).astype(self.dtype)
+
+        # Do the same for the REI and host nuclear Zeeman operators but there 
+        # is no distinction between GS and ES. We assume the nuclear g factors
+        # are isotropic scalars. Each term only acts on its own subsystem.
+        # Terms with a zero g factor (e.g. switched off with nuclear_zeeman_rei)
+        # are left out.
+        nuclear_terms = []
+        if self.g_n_rei != 0:
+            nuclear_terms.append((1, (self.g_n_rei * self.Iv3).reshape((3, self.multI, self.multI))))
+        for neigh_idx, neigh in enumerate(self.neighbours):
+            if neigh.g_n_host != 0:
+                nuclear_terms.append((2 + neigh_idx, neigh.g_n_host * neigh.H))
+
+        # If there are no nuclear Zeeman terms at all they are skipped
+        # everywhere instead of adding zeros for every B
+        self.nuclear_zeeman = len(nuclear_terms) > 0
+        # (subsystem index, 3 x m x m operators) of each nuclear term
+        self.O_n_local = [(k, term.astype(self.dtype)) for k, term in nuclear_terms]
+
+    def initialize_dense_operators(self):
+        """ Expands the local blocks into the full D x D matrices used by the
+        dense methods: the field independent Hamiltonians H0_gs and H0_es, the 
+        3 x D x D Zeeman operators, the Hamiltonian buffers and the transition
+        operators. The blocks are written straight into the positions where
+        the Kronecker products with identities would have put them. """
+
+        # Hyperfine and SHF pieces. A switched off hyperfine term (None) is 
+        # left out rather than adding a D x D matrix of zeros.
+        host_dim = self.subsystem_dims(1)[1]
+        H0_dense = []
+        for HHF, SHF in ((self.HHF_gs_local, self.SHF_gs_local), (self.HHF_es_local, self.SHF_es_local)):
+            H0 = np.zeros((self.dim, self.dim), dtype=self.dtype)
+            if HHF is not None:
+                add_kron_identity(H0, HHF, 1, host_dim)
+            for coeffs, mid_dim, right_dim in SHF:
+                add_pair_kron_identity(H0, coeffs, mid_dim, right_dim)
+            H0_dense.append(H0)
+        self.H0_gs, self.H0_es = H0_dense
+
+        # Electronic Zeeman operators expanded into the nuclear spin spaces
+        self.O_el_gs = np.array([expand_with_identities(O, *self.subsystem_dims(0)) for O in self.O_el_gs_local])
+        self.O_el_es = np.array([expand_with_identities(O, *self.subsystem_dims(0)) for O in self.O_el_es_local])
+        if self.nuclear_zeeman:
+            # Sum of the REI and host nuclear Zeeman operators
+            self.O_n = np.zeros((3, self.dim, self.dim), dtype=self.dtype)
             for i in range(3):
-                gs_term = np.kron(mu_REI_gs[i], np.identity(self.multI))
-                es_term = np.kron(mu_REI_es[i], np.identity(self.multI))
-
-                for inner_neigh_idx, inner_neigh in enumerate(self.neighbours):
-                    if inner_neigh_idx == neigh_idx:
-                        gs_term = np.kron(gs_term, mu_host[i])
-                        es_term = np.kron(es_term, mu_host[i])
-                    else:
-                        gs_term = np.kron(gs_term, np.identity(inner_neigh.multH))
-                        es_term = np.kron(es_term, np.identity(inner_neigh.multH))
-
-                first_term_gs += gs_term / neigh.R**3
-                first_term_es += es_term / neigh.R**3
-
-            # Take the dot product then reshape back
-            dot_REI_gs = neigh.disp_vector.dot(mu_REI_gs_v3).reshape((self.multS, self.multS))
-            dot_REI_es = neigh.disp_vector.dot(mu_REI_es_v3).reshape((self.multS, self.multS))
-            dot_host = neigh.disp_vector.dot(mu_host_v3).reshape((neigh.multH, neigh.multH))
-            # Expand into the REI nuclear space first
-            dot_REI_gs = np.kron(dot_REI_gs, np.identity(self.multI))
-            dot_REI_es = np.kron(dot_REI_es, np.identity(self.multI))
-
-            # Second term is 3(mu_REI dot R)(mu_host dot R)/R^5
-            for inner_neigh_idx, inner_neigh in enumerate(self.neighbours):
-                if inner_neigh_idx == neigh_idx:
-                    dot_REI_gs = np.kron(dot_REI_gs, dot_host)
-                    dot_REI_es = np.kron(dot_REI_es, dot_host)
-                else:
-                    dot_REI_gs = np.kron(dot_REI_gs, np.identity(inner_neigh.multH))
-                    dot_REI_es = np.kron(dot_REI_es, np.identity(inner_neigh.multH))
+                for k, term in self.O_n_local:
+                    add_kron_identity(self.O_n[i], term[i], *self.subsystem_dims(k))
+
+        # Buffers for the full Hamiltonians, which are overwritten in place 
+        # every time B changes instead of being reallocated
+        self.H_gs = np.empty_like(self.H0_gs)
+        self.H_es = np.empty_like(self.H0_es)
+
+        # Transition operators for the 3 axes (expanded into REI nuclear and 
+        # host spaces), which are field independent so we only compute them once.
+        self.bigSx, self.bigSy, self.bigSz = [expand_with_identities(2*s, *self.subsystem_dims(0)).astype(self.dtype) for s in (self.sx, self.sy, self.sz)]
+
+    def initialize_sparse_operators(self):
+        """ Stores the field independent Hamiltonians and the Zeeman operators
+        as sparse CSR matrices. Apart from the diagonal blocks most entries are
+        zero since every term only acts on one or two of the subsystems, so 
+        they are built straight from the local blocks of each term with sparse
+        Kronecker products instead of from the dense matrices. """
+
+        host_dim = self.subsystem_dims(1)[1]
+        H0_sparse = []
+        for HHF, SHF in ((self.HHF_gs_local, self.SHF_gs_local), (self.HHF_es_local, self.SHF_es_local)):
+            H0 = scipy.sparse.csr_matrix((self.dim, self.dim), dtype=self.dtype)
+            if HHF is not None:
+                H0 = H0 + sparse_kron_identity(HHF, 1, host_dim)
+            for coeffs, mid_dim, right_dim in SHF:
+                H0 = H0 + sparse_pair_kron_identity(coeffs, mid_dim, right_dim)
+            H0_sparse.append(H0)
+        self.H0_gs_sparse, self.H0_es_sparse = H0_sparse
+
+        self.O_el_gs_sparse = [sparse_kron_identity(O, *self.subsystem_dims(0)) for O in self.O_el_gs_local]
+        self.O_el_es_sparse = [sparse_kron_identity(O, *self.subsystem_dims(0)) for O in self.O_el_es_local]
+        if self.nuclear_zeeman:
+            self.O_n_sparse = []
+            for i in range(3):
+                O_n = scipy.sparse.csr_matrix((self.dim, self.dim), dtype=self.dtype)
+                for k, term in self.O_n_local:
+                    O_n = O_n + sparse_kron_identity(term[i], *self.subsystem_dims(k))
+                self.O_n_sparse.append(O_n)
+        self.sparse_initialized = True
 
-            second_term_gs += (3/neigh.R**5) * dot_REI_gs
-            second_term_es += (3/neigh.R**5) * dot_REI_es
+    def sparse_hamiltonian(self, state, B, B_theta, B_phi):
+        """ Returns the full Hamiltonian of state ('gs' or 'es') at the given 
+        B field as a sparse CSR matrix, without changing the current state. """
 
-        # Divide by the constant factor to convert from J to GHz
-        # First 10**-7 comes from mu0/4pi
-        self.H_SHF_gs = 10**-7 * (first_term_gs - second_term_gs) / (self.h * 10**9)
-        self.H_SHF_es = 10**-7 * (first_term_es - second_term_es) / (self.h * 10**9)
+        if not self.sparse_initialized:
+            self.initialize_sparse_operators()
+
+        B_vec = (B * self.unit_vector(B_theta, B_phi)).astype(self.real_dtype)
+        if state == 'gs':
+            H, O_el = self.H0_gs_sparse, self.O_el_gs_sparse
+        elif state == 'es':
+            H, O_el = self.H0_es_sparse, self.O_el_es_sparse
+        else:
+            raise Exception
+
+        # Same Zeeman terms and signs as in update_zeeman_ham
+        for i in range(3):
+            H = H + self.beta_el * B_vec[i] * O_el[i]
+            if self.nuclear_zeeman:
+                H = H - self.beta_n * B_vec[i] * self.O_n_sparse[i]
+        return H
+
+    def hamiltonian_operator(self, state, B, B_theta, B_phi):
+        """ Returns the full Hamiltonian of state ('gs' or 'es') at the given
+        B field as a matrix free LinearOperator. Only the small local blocks of
+        each term are kept and applied to psi viewed as a tensor over the 
+        subsystems, so no D x D matrix (dense or sparse) is formed. """
+
+        B_vec = (B * self.unit_vector(B_theta, B_phi)).astype(self.real_dtype)
+        if state == 'gs':
+            HHF, O_el, SHF = self.HHF_gs_local, self.O_el_gs_local, self.SHF_gs_local
+        elif state == 'es':
+            HHF, O_el, SHF = self.HHF_es_local, self.O_el_es_local, self.SHF_es_local
+        else:
+            raise Exception
+
+        # Terms acting on a single block of subsystems as (X, left_dim, 
+        # right_dim), with the same Zeeman terms and signs as in 
+        # update_zeeman_ham
+        single_terms = [(np.tensordot(self.beta_el * B_vec, O_el, 1), *self.subsystem_dims(0))]
+        for k, term in self.O_n_local:
+            single_terms.append((-np.tensordot(self.beta_n * B_vec, term, 1), *self.subsystem_dims(k)))
+        if HHF is not None:
+            single_terms.append((HHF, 1, self.subsystem_dims(1)[1]))
+
+        def matvec(psi):
+            out = np.zeros(psi.shape, dtype=np.result_type(psi, self.dtype))
+            for X, left_dim, right_dim in single_terms:
+                out += apply_kron_identity(X, psi, left_dim, right_dim)
+            for coeffs, mid_dim, right_dim in SHF:
+                out += apply_pair_kron_identity(coeffs, psi, mid_dim, right_dim)
+            return out
+
+        # H is Hermitian so the adjoint product is the same
+        return scipy.sparse.linalg.LinearOperator((self.dim, self.dim), matvec=matvec, rmatvec=matvec, dtype=self.dtype)
+
+    def extreme_energies_sparse(self, state, B, B_theta, B_phi, k=2, ncv=80, matrix_free=False):
+        """ Uses Lanczos iterations on the sparse Hamiltonian to compute only 
+        the k lowest and k highest energies of state at the given B field. 
+        Much cheaper than a full diagonalisation once there are many host 
+        nuclei. Returns the 2k energies in increasing order. ncv is the number
+        of Lanczos vectors, which needs to be fairly large for ARPACK to 
+        converge since the superhyperfine levels are nearly degenerate. If 
+        matrix_free is True the matrix free hamiltonian_operator is used 
+        instead of the sparse matrix. Together with dense=False in the 
+        constructor this needs only O(D) memory besides the Lanczos vectors. """
+
+        if matrix_free:
+            H = self.hamiltonian_operator(state, B, B_theta, B_phi)
+            # A random vector is only mapped to zero by a zero Hamiltonian
+            is_zero = not np.any(H.matvec(np.random.default_rng(0).random(self.dim)))
+        else:
+            H = self.sparse_hamiltonian(state, B, B_theta, B_phi)
+            is_zero = H.count_nonzero() == 0
+        # ARPACK cannot start from a zero Hamiltonian (e.g. the Eu ES at B = 0)
+        if is_zero:
+            return np.zeros(2*k)
+        ncv = min(ncv, H.shape[0])
+        lowest = scipy.sparse.linalg.eigsh(H, k=k, which='SA', ncv=ncv, return_eigenvectors=False)
+        highest = scipy.sparse.linalg.eigsh(H, k=k, which='LA', ncv=ncv, return_eigenvectors=False)
+        return np.concatenate((np.sort(lowest), np.sort(highest)))
 
     def update_zeeman_ham(self, B, B_theta, B_phi):
         """ Given a (new) value of the magnetic field, compute the new Zeeman
         interaction term in the hamiltonian and then update the hamiltonian. """
 
+        self.check_dense()
         # Convert B into cartesian
-        B_vec = B * np.array([  np.sin(B_theta) * np.cos(B_phi),
-                                np.sin(B_theta) * np.sin(B_phi),    
-                                np.cos(B_theta)])
+        B_vec = (B * self.unit_vector(B_theta, B_phi)).astype(self.real_dtype)
 
         # Compute the electronic Zeeman Hamiltonian using beta * B @ g @ S
-        HZ_el_gs = (self.beta_el * B_vec @ self.g_gs @ self.Sv3).reshape((self.multS, self.multS))
-        HZ_el_es = (self.beta_el * B_vec @ self.g_es @ self.Sv3).reshape((self.multS, self.multS))
-        # Expand into the nuclear spin space
-        HZ_el_gs = np.kron(HZ_el_gs, np.identity(self.multI))
-        HZ_el_es = np.kron(HZ_el_es, np.identity(self.multI))
-        # Then expand into the superhyperfine nuclear spin space
-        for neigh in self.neighbours: 
-            HZ_el_gs = np.kron(HZ_el_gs, np.identity(neigh.multH))
-            HZ_el_es = np.kron(HZ_el_es, np.identity(neigh.multH))
-
-        # Do the same for the REI nuclear Zeeman Hamiltonian but there is no 
-        # distinction between GS and ES. We assume the nuclear g factor is an 
-        # isotropic scalar.
-        HZ_n_rei = (self.beta_n * self.g_n_rei * B_vec @ self.Iv3).reshape((self.multI, self.multI))
-        # Expand into the electronic spin space
-        HZ_n_rei = np.kron(np.identity(self.multS), HZ_n_rei)
-        # Expand into the superhyperfine nuclear spin space
-        for neigh in self.neighbours: 
-            HZ_n_rei = np.kron(HZ_n_rei, np.identity(neigh.multH))
-
-        # Do the same for the nuclear Zeeman Hamiltonian for the host nuclear spin
-        HZ_n_host = 0
-        for neigh_idx, neigh in enumerate(self.neighbours):
-            # Start with a blank template for the S and I spaces
-            HZ_n_host_accum = np.kron(np.identity(self.multS), np.identity(self.multI))
-            HZ_n_host_term = (self.beta_n * neigh.g_n_host * B_vec @ neigh.Hv3).reshape((neigh.multH, neigh.multH))
-
-            # Iterate through the neighbours and expand into their spaces
-            # When it's its own index we cross the actual Zeeman interaction instead
-            for inner_neigh_idx, inner_neigh in enumerate(self.neighbours):
-                if inner_neigh_idx == neigh_idx:
-                    HZ_n_host_accum = np.kron(HZ_n_host_accum, HZ_n_host_term)
-                else:
-                    HZ_n_host_accum = np.kron(HZ_n_host_accum, np.identity(inner_neigh.multH))
-
-            HZ_n_host += HZ_n_host_accum
+        # and the nuclear one using beta * B @ g_n @ I, i.e. contract B with 
+        # the x, y, z components of the precomputed Zeeman operators. The 
+        # prefactors go onto the 3-vector rather than the D x D result.
+        HZ_el_gs = np.tensordot(self.beta_el * B_vec, self.O_el_gs, 1)
+        HZ_el_es = np.tensordot(self.beta_el * B_vec, self.O_el_es, 1)
 
         # Reset the Hamiltonian to be only the field-indep HF part and SHF part
         self.reset_ham()
@@ -267,8 +403,12 @@ class SpinSystem:
         # Minus for the nuclear terms since U = -mu.B but no minus for electron
         # since the mu we calculated above is actually negative of what it
         # really is.
-        self.H_gs += (HZ_el_gs - HZ_n_rei - HZ_n_host)
-        self.H_es += (HZ_el_es - HZ_n_rei - HZ_n_host)
+        self.H_gs += HZ_el_gs
+        self.H_es += HZ_el_es
+        if self.nuclear_zeeman:
+            HZ_n = np.tensordot(self.beta_n * B_vec, self.O_n, 1)
+            self.H_gs -= HZ_n
+            self.H_es -= HZ_n
 
     def update_B(self, B, B_theta, B_phi):
         """ Updates the Zeeman Hamiltonian contribution from a newly
@@ -284,17 +424,76 @@ class SpinSystem:
     def calc_energies(self):
         """ Compute energies for the current Hamiltonian and updates state."""
 
-        # Get the ground state eigvals and eigvecs
-        eigval_gs, eigvec_gs = np.linalg.eig(self.H_gs)
-        # Sort the columns of the eigvecs in increasing size of the eigvals
-        self.E_gs = sorted(eigval_gs)
-        self.eigvec_gs = eigvec_gs[:, np.argsort(eigval_gs)]
+        self.check_dense()
+        # The Hamiltonians are Hermitian so eigh gives real eigvals, already 
+        # sorted in increasing order, and orthonormal eigvecs as columns
+        self.E_gs, self.eigvec_gs = np.linalg.eigh(self.H_gs)
+        self.E_es, self.eigvec_es = np.linalg.eigh(self.H_es)
+
+    def hamiltonians_brange(self, B_range, B_theta, B_phi, states=('gs', 'es')):
+        """ Returns the GS and ES Hamiltonians for every B in B_range stacked
+        along the first axis, i.e. with dimensions len(B_range) x D x D. Only
+        the states listed in states are built and returned, in that order. """
+
+        self.check_dense()
+        # The direction of B is the same for the whole range, so contract it 
+        # with the Zeeman operators only once. Each B then just scales the 
+        # resulting D x D Zeeman Hamiltonians for a unit field.
+        B_dir = self.unit_vector(B_theta, B_phi).astype(self.real_dtype)
+        B_scale = np.asarray(B_range, dtype=self.real_dtype)[:, None, None]
+
+        # The nuclear Zeeman terms are the same for the GS and ES so they are
+        # only built once and shared. Everything else (hyperfine, SHF and 
+        # electronic Zeeman) is specific to each state.
+        if self.nuclear_zeeman:
+            HZ_n = np.tensordot(self.beta_n * B_dir, self.O_n, 1)
+
+        Hs = []
+        for state in states:
+            if state == 'gs':
+                H0, O_el = self.H0_gs, self.O_el_gs
+            elif state == 'es':
+                H0, O_el = self.H0_es, self.O_el_es
+            else:
+                raise Exception
 
-        # Do the same for the excited state
-        eigval_es, eigvec_es = np.linalg.eig(self.H_es)
-        # Sort the columns of the eigvecs in increasing size of the eigvals
-        self.E_es = sorted(eigval_es)
-        self.eigvec_es = eigvec_es[:, np.argsort(eigval_es)]
+            # Same as update_zeeman_ham but for a whole stack of B's. The 
+            # nuclear term is folded into the D x D unit field Zeeman 
+            # Hamiltonian first so that the N x D x D stack is allocated once
+            # and then added to in place.
+            HZ = np.tensordot(self.beta_el * B_dir, O_el, 1)
+            if self.nuclear_zeeman:
+                HZ -= HZ_n
+            H = np.multiply(B_scale, HZ)
+            H += H0
+            Hs.append(H)
+        return tuple(Hs)
+
+    def calc_energies_brange(self, B_range, B_theta, B_phi):
+        """ Computes the energies and eigvecs for every B in B_range using a 
+        single batched eigh call per state instead of one per B. Returns
+        (E_gs, eigvec_gs, E_es, eigvec_es) stacked along the first axis. """
+
+        H_gs, H_es = self.hamiltonians_brange(B_range, B_theta, B_phi)
+        # The Hamiltonians are Hermitian so eigh gives real eigvals already 
+        # sorted in increasing order
+        E_gs, eigvec_gs = np.linalg.eigh(H_gs)
+        E_es, eigvec_es = np.linalg.eigh(H_es)
+        return E_gs, eigvec_gs, E_es, eigvec_es
+
+    def energies_brange(self, B_range, B_theta, B_phi, states=('gs', 'es'), B_chunk=16):
+        """ Returns only the energies (no eigvecs) of the states listed in 
+        states for every B in B_range, each with dimensions len(B_range) x D. 
+        The B fields are diagonalised in batched chunks of B_chunk so that only
+        the Hamiltonians of one chunk are held at a time. """
+
+        B_range = np.asarray(B_range)
+        Es = tuple(np.zeros((len(B_range), self.dim), dtype=self.real_dtype) for _ in states)
+        for start in range(0, len(B_range), B_chunk):
+            Hs = self.hamiltonians_brange(B_range[start:start+B_chunk], B_theta, B_phi, states)
+            for E, H in zip(Es, Hs):
+                E[start:start+B_chunk] = np.linalg.eigvalsh(H)
+        return Es
 
     def energies(self, state, B=None, B_theta=None, B_phi=None):
         """ Returns energies of a system with the hyperfine interaction and 
@@ -331,6 +530,13 @@ class SpinSystem:
                 es_transitions.append((self.E_es[j]-self.E_es[i], (1,1,1)))
         return [gs_transitions, es_transitions]
 
+    def spin_transition_energies(self, E):
+        """ Returns the energy differences E[j] - E[i] for all i < j in the 
+        same order as spin_transitions. E can be a stack of energies, in which 
+        case the differences are taken along the last axis. """
+        i, j = np.triu_indices(E.shape[-1], k=1)
+        return E[..., j] - E[..., i]
+
     def optical_transitions(self, B=None, B_theta=None, B_phi=None, compute_strengths=False):
         """ Computes the transitions between the energy levels. Optional to
         provide a B field to update before computing. """
@@ -348,20 +554,43 @@ class SpinSystem:
                     transitions.append((e_e-e_g, None, (idx_g, idx_e)))
         return transitions
 
-    def superhyperfine_levels(self, state, B=None, B_theta=None, B_phi=None):
+    def superhyperfine_levels(self, state, B=None, B_theta=None, B_phi=None, sparse=False, matrix_free=False):
         """ Looks at the lower electronic zeeman branch of the ground state to 
         look at the superhyperfine energy splittings. Returns the energy of the 
         doublet's upper and lower levels relative to their average as well as 
-        the energy gap. """
-
-        if B is not None and B_theta is not None and B_phi is not None:
-            self.update_B(B, B_theta, B_phi)
+        the energy gap, and the same for the highest doublet, as an array of 
+        6 values. B can also be an array of N B fields, in which case they 
+        are diagonalised in batched chunks (without changing the state, see 
+        energies_brange) and an N x 6 array is returned instead. If sparse is True only the required
+        levels are found with a sparse Lanczos solver instead, which is 
+        worthwhile for large numbers of neighbours, and matrix_free then 
+        selects the matrix free operator (see extreme_energies_sparse). The
+        sparse path does not use the stored state, so B, B_theta and B_phi
+        must be given. """
+
+        if sparse:
+            if B is None or B_theta is None or B_phi is None:
+                raise Exception("B, B_theta and B_phi are required for the sparse path")
+            # Lowest 2 and highest 2 energies for each B (preallocated so an
+            # empty range still gives an N x 4 array)
+            B_arr = np.atleast_1d(B)
+            E = np.zeros((len(B_arr), 4))
+            for idx, b in enumerate(B_arr):
+                E[idx] = self.extreme_energies_sparse(state, b, B_theta, B_phi, matrix_free=matrix_free)
+            if np.ndim(B) == 0:
+                E = E[0]
+        elif np.ndim(B) > 0:
+            # Only the eigvals of the requested state are needed, so skip the
+            # eigvecs and the other state's Hamiltonians entirely
+            E, = self.energies_brange(B, B_theta, B_phi, states=(state,))
+        else:
+            E = np.array(self.energies(state, B, B_theta, B_phi))
 
         # Pick the lowest and 2nd lowest energy levels and assume that these
         # represent the energy splitting of the lowest energy state due to 
         # the superhyperfine interaction. 
-        low = self.energies(state, B, B_theta, B_phi)[0]
-        up = self.energies(state, B, B_theta, B_phi)[1]
+        low = E[..., 0]
+        up = E[..., 1]
         avg = (low + up) / 2
 
         # Convert from GHz to KHz since this is really small
@@ -370,8 +599,8 @@ class SpinSystem:
         diff = (up - low) * 10**6
 
         # Look at the highest 2 states instead
-        low2 = self.energies(state, B, B_theta, B_phi)[-2]
-        up2 = self.energies(state, B, B_theta, B_phi)[-1]
+        low2 = E[..., -2]
+        up2 = E[..., -1]
         avg2 = (low2 + up2) / 2
 
         # Convert from GHz to KHz since this is really small
@@ -379,18 +608,41 @@ class SpinSystem:
         upper2 = (up2 - avg2) * 10**6
         diff2 = (up2 - low2) * 10**6
 
-        return lower, upper, diff, lower2, upper2, diff2
+        # Stack as the last axis so each quantity is a column over B
+        return np.stack((lower, upper, diff, lower2, upper2, diff2), axis=-1)
+
+    def superhyperfine_sweep(self, state, B_range, B_theta, B_phi, sparse=False, workers=1, matrix_free=False):
+        """ Same as superhyperfine_levels for an array of B fields but can 
+        split B_range into one chunk per worker thread and handle the chunks 
+        in parallel. Returns an N x 6 array. With the default workers=1 this 
+        is just the serial batched call.
+
+        Threads only help on the dense and sparse matrix paths, where the time
+        is spent in LAPACK/ARPACK with the GIL released, and only if BLAS is 
+        limited to fewer threads (e.g. OMP_NUM_THREADS) since a batched eigh
+        is already multithreaded and would otherwise oversubscribe the cores.
+        The matrix_free matvec runs NumPy code under the GIL every iteration,
+        so threads give no speedup there. """
+
+        B_range = np.asarray(B_range)
+        if workers == 1 or len(B_range) <= 1:
+            return self.superhyperfine_levels(state, B_range, B_theta, B_phi, sparse, matrix_free)
+        # The sparse operators are built lazily on first use, so build them 
+        # here before the threads would race to do it concurrently
+        if sparse and not matrix_free and not self.sparse_initialized:
+            self.initialize_sparse_operators()
+        chunks = np.array_split(B_range, min(workers, len(B_range)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            levels = executor.map(lambda B: self.superhyperfine_levels(state, B, B_theta, B_phi, sparse, matrix_free), chunks)
+            return np.concatenate(list(levels))
 
     def branching_contrast(self, B=None, B_theta=None, B_phi=None, stated_levels=None):
         """ Computes the branching contrast of the system (given its current 
         displacement vector of the host atom) using the formula given in Car. """
+        self.check_dense()
         if B is not None and B_theta is not None and B_phi is not None:
             self.update_B(B, B_theta, B_phi)
 
-        bigSx = 2*np.kron(np.kron(self.sx, np.identity(self.multI)), np.identity(self.multH))
-        bigSy = 2*np.kron(np.kron(self.sy, np.identity(self.multI)), np.identity(self.multH))
-        bigSz = 2*np.kron(np.kron(self.sz, np.identity(self.multI)), np.identity(self.multH))
-
         if stated_levels is None:
             gs_lower = self.eigvec_gs[:, 0]
             gs_upper = self.eigvec_gs[:, 1]
@@ -402,8 +654,8 @@ class SpinSystem:
             es_lower = self.eigvec_es[:, k]
 
         # Overlap while enclosing the Sx, Sy, Sz matrices
-        r_23_S_x = abs(gs_upper.conjugate() @ bigSx @ es_lower.T)**2
-        r_13_S_x = abs(gs_lower.conjugate() @ bigSx @ es_lower.T)**2
+        r_23_S_x = abs(gs_upper.conjugate() @ self.bigSx @ es_lower.T)**2
+        r_13_S_x = abs(gs_lower.conjugate() @ self.bigSx @ es_lower.T)**2
 
         RS_x = r_23_S_x / r_13_S_x
         rho_S_x = 4 * RS_x / (1 + RS_x)**2
@@ -414,19 +666,12 @@ class SpinSystem:
         """ Computes the transition strength for two eigenvectors initial and
         final for the 3 possible polarisation axes. """
 
-        # Transition operator for the 3 axes (expanded into REI nuclear)
-        bigSx = 2*np.kron(self.sx, np.identity(self.multI))
-        bigSy = 2*np.kron(self.sy, np.identity(self.multI))
-        bigSz = 2*np.kron(self.sz, np.identity(self.multI))
-        # Expand into host spaces
-        for neigh in self.neighbours:
-            bigSx = np.kron(bigSx, np.identity(neigh.multH))
-            bigSy = np.kron(bigSy, np.identity(neigh.multH))
-            bigSz = np.kron(bigSz, np.identity(neigh.multH))
-        # Compute the mod square of the inner product
-        fx = abs(final.conjugate() @ bigSx @ initial) ** 2
-        fy = abs(final.conjugate() @ bigSy @ initial) ** 2
-        fz = abs(final.conjugate() @ bigSz @ initial) ** 2
+        self.check_dense()
+        # Compute the mod square of the inner product using the precomputed
+        # transition operators
+        fx = abs(final.conjugate() @ self.bigSx @ initial) ** 2
+        fy = abs(final.conjugate() @ self.bigSy @ initial) ** 2
+        fz = abs(final.conjugate() @ self.bigSz @ initial) ** 2
         return fx, fy, fz
 
 ############################
@@ -601,49 +846,66 @@ class SpinSystem:
         """ Plot all the spin transition energies as a function of B field. """
         plt.figure()
         plt.suptitle("Spin Transitions within energy level")
+        # Diagonalise the Hamiltonians for the B fields in batched chunks
+        E_gs, E_es = self.energies_brange(B_range, B_theta, B_phi)
+        # Leave the system in the state of the last B field as before
+        if len(B_range) > 0:
+            self.update_B(B_range[-1], B_theta, B_phi)
         plt.subplot(211)
-        plt.plot(B_range, np.array([[transition[0] for transition in self.spin_transitions(b, B_theta, B_phi)[1]] for b in B_range]))
+        plt.plot(B_range, self.spin_transition_energies(E_es))
         plt.title("Excited State Transitions")
         plt.xlabel("B field / T")
         plt.ylabel("Transition Energy / GHz")
         plt.subplot(212)
-        plt.plot(B_range, np.array([[transition[0] for transition in self.spin_transitions(b, B_theta, B_phi)[0]] for b in B_range]))
+        plt.plot(B_range, self.spin_transition_energies(E_gs))
         plt.title("Ground State Transitions")
         plt.xlabel("B field / T")
         plt.ylabel("Transition Energy / GHz")
 
-    def plot_superhyperfine(self, B_range, B_theta, B_phi):
+    def plot_superhyperfine(self, B_range, B_theta, B_phi, sparse=False, matrix_free=False, workers=1):
         """ Plot the superhyperfine splitted levels for the lowest energy levels
         (i.e. plot the lowest 2 energy levels after incorporating the SHF
         interaction). In addition, plot the energy gap between these SHF-split
-        energy levels.
+        energy levels. sparse, matrix_free and workers are passed on to 
+        superhyperfine_sweep. Only the dense path leaves the system in the 
+        state of the last B field, since the sparse paths never diagonalise
+        the full Hamiltonian (and a dense=False system has no state).
         """
+        # Compute the levels for each state only once and reuse them for all 
+        # the panels
+        gs_levels = self.superhyperfine_sweep('gs', B_range, B_theta, B_phi, sparse, workers, matrix_free)
+        es_levels = self.superhyperfine_sweep('es', B_range, B_theta, B_phi, sparse, workers, matrix_free)
+
         plt.figure()
         plt.suptitle("Superhyperfine splittings")
 
         ax1 = plt.subplot2grid((2, 2), (0, 0), colspan=1)
-        ax1.plot(B_range, [self.superhyperfine_levels('gs', b, B_theta, B_phi)[:2] for b in B_range], c='C0')
-        ax1.plot(B_range, [self.superhyperfine_levels('gs', b, B_theta, B_phi)[3:5] for b in B_range], c='C2')
+        ax1.plot(B_range, gs_levels[:, :2], c='C0')
+        ax1.plot(B_range, gs_levels[:, 3:5], c='C2')
         ax1.set_title("Relative Energies of ground superhyperfine doublet")
         ax1.set_xlabel("B field / T")
         ax1.set_ylabel("Relative Energy / kHz")
 
         ax2 = plt.subplot2grid((2, 2), (0, 1), colspan=1)
-        ax2.plot(B_range, [self.superhyperfine_levels('es', b, B_theta, B_phi)[:2] for b in B_range], c='C1')
-        ax2.plot(B_range, [self.superhyperfine_levels('es', b, B_theta, B_phi)[3:5] for b in B_range], c='C3')
+        ax2.plot(B_range, es_levels[:, :2], c='C1')
+        ax2.plot(B_range, es_levels[:, 3:5], c='C3')
         ax2.set_title("Relative Energies of excited superhyperfine doublet")
         ax2.set_xlabel("B field / T")
         ax2.set_ylabel("Relative Energy / kHz")
 
         ax3 = plt.subplot2grid((2, 2), (1, 0), colspan=2)
-        ax3.plot(B_range, [self.superhyperfine_levels('gs', b, B_theta, B_phi)[2] for b in B_range], c='C0', label="Ground state Lower")
-        ax3.plot(B_range, [self.superhyperfine_levels('gs', b, B_theta, B_phi)[5] for b in B_range], c='C2', label="Ground state Upper")
-        ax3.plot(B_range, [self.superhyperfine_levels('es', b, B_theta, B_phi)[2] for b in B_range], c='C1', label="Excited state Lower")
-        ax3.plot(B_range, [self.superhyperfine_levels('es', b, B_theta, B_phi)[5] for b in B_range], c='C3', label="Excited state Upper")
+        ax3.plot(B_range, gs_levels[:, 2], c='C0', label="Ground state Lower")
+        ax3.plot(B_range, gs_levels[:, 5], c='C2', label="Ground state Upper")
+        ax3.plot(B_range, es_levels[:, 2], c='C1', label="Excited state Lower")
+        ax3.plot(B_range, es_levels[:, 5], c='C3', label="Excited state Upper")
         ax3.set_title("Energy gap between the superhyperfine doublet levels")
         ax3.set_xlabel("B field / T")
         ax3.set_ylabel("Transition Energy / kHz")
         ax3.legend()
+
+        # Leave the system in the state of the last B field as before
+        if self.dense and not sparse and len(B_range) > 0:
+            self.update_B(B_range[-1], B_theta, B_phi)
 ################################################################################
 
 yb171_A_gs = np.array([[0.6745, 0,  0], #0.675, -4.82, from Ranon 1968, Kindem 2018
@@ -703,15 +965,35 @@ yb171_g_nuclear = 0.98734
 ################################################################################
 
 def rot(a, b, c):
-    A = np.array([[np.cos(a), -np.sin(a), 0], [np.sin(a), np.cos(a), 0], [0, 0, 1]])
-    B = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
-    C = np.array([[np.cos(c), -np.sin(c), 0], [np.sin(c), np.cos(c), 0], [0, 0, 1]])
-    return A @ B @ C
+    """ Rotation matrix for the z-y-z Euler angles a, b, c. The angles can also
+    be arrays (broadcast against each other), in which case a stack of 
+    rotation matrices with dimensions ... x 3 x 3 is returned. """
+    a, b, c = np.broadcast_arrays(a, b, c)
+
+    def z_rot(t):
+        R = np.zeros(t.shape + (3, 3))
+        R[..., 0, 0], R[..., 0, 1] = np.cos(t), -np.sin(t)
+        R[..., 1, 0], R[..., 1, 1] = np.sin(t), np.cos(t)
+        R[..., 2, 2] = 1
+        return R
+
+    def y_rot(t):
+        R = np.zeros(t.shape + (3, 3))
+        R[..., 0, 0], R[..., 0, 2] = np.cos(t), np.sin(t)
+        R[..., 1, 1] = 1
+        R[..., 2, 0], R[..., 2, 2] = -np.sin(t), np.cos(t)
+        return R
+
+    # Matrix products broadcast over any leading stack dimensions
+    return z_rot(a) @ y_rot(b) @ z_rot(c)
 
 alpha = 144.9 / 180 * np.pi
 beta = 34.9 / 180 * np.pi
 gamma = 98.1 / 180 * np.pi
-eu_g_gs = -rot(alpha, beta, gamma) @ np.diag([0.443, 0.5682, 1.1183]) @ rot(alpha, beta, gamma).T
+# Build the rotation once and reuse it for both sides
+R_gs = rot(alpha, beta, gamma)
+# R @ diag(d) @ R.T but scaling the columns of R directly
+eu_g_gs = -(R_gs * np.array([0.443, 0.5682, 1.1183])) @ R_gs.T
 eu_g_gs *= 10**7 # Convert from kHz/G to Hz/T
 eu_g_gs *= (SpinSystem.h / SpinSystem.mu_b) # Convert from Hz/T to dimensionless
 # Use this g matrix for electron spin to represent nuclear spin in Eu
@@ -724,7 +1006,8 @@ eu_nuclear_spin = 0
 alpha = -39.3 / 180 * np.pi
 beta = 76.49 / 180 * np.pi
 gamma = 149.9 / 180 * np.pi
-eu_A_gs = rot(alpha, beta, gamma) @ np.diag([-2.735, 2.735, 12.3797]) @ rot(alpha, beta, gamma).T
+R_A = rot(alpha, beta, gamma)
+eu_A_gs = (R_A * np.array([-2.735, 2.735, 12.3797])) @ R_A.T
 eu_A_gs /= 1000 # Convert MHz -> GHz
 
 eu_A_es = np.zeros((3, 3))
@@ -750,6 +1033,8 @@ A = SpinSystem(
     )
 
 # {1.93192, 1.80589, -0.34195}
-A.plot_spin_transitions(np.arange(0, 3, 0.01), 1.80589, -0.34195)
+# 301 evenly spaced fields from 0 to 3 T, endpoints included
+B_range = np.linspace(0.0, 3.0, 301)
+A.plot_spin_transitions(B_range, 1.80589, -0.34195)
 plt.show()
 ################################################################################
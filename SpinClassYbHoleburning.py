@@ -1,53 +1,37 @@
 import os
-import copy
 import bisect
+import itertools
 import numpy as np
 import matplotlib as mpl
 import scipy.signal
+import scipy.sparse
 import matplotlib.pyplot as plt
+from SpinOperators import (generate_spin_matrices, add_pair_kron_identity,
+                           expand_with_identities, sparse_kron_identity)
 
 mpl.rcParams["savefig.directory"] = "."
 np.set_printoptions(precision=7, edgeitems=30, linewidth=100000)
 mpl.rcParams.update({'font.size': 24})
 
-def generate_spin_matrices(spin):
-    """ Generates the x, y, z spin matrices for an arbitrary spin"""
-    if spin == 0:
-        return np.array((0,)), np.array((0,)), np.array((0,))
-
-    # Dimension of spin matrices of a given spin
-    dim = int(2 * spin + 1)
-    # Generates a descending list from spin to -spin in steps of -1
-    desc = np.arange(spin, -spin-1, -1)
-
-    # Create a template for the spin matrices
-    sx = np.zeros((dim, dim), dtype=complex)
-    sy = np.zeros((dim, dim), dtype=complex)
-    sz = np.zeros((dim, dim), dtype=complex)
-
-    # Generate the spin matrices using the formula
-    # http://easyspin.org/documentation/spinoperators.html
-    for row in range(dim):
-        sz[row, row] = desc[row]
-
-        if row == 0:
-            sx[row, row+1] = 1/2*np.sqrt(spin*(spin+1)-desc[row]*desc[row+1])
-            sy[row, row+1] = -(1j/2)*np.sqrt(spin*(spin+1)-desc[row]*desc[row+1])
-        elif row == dim-1:
-            sx[row, row-1] = 1/2*np.sqrt(spin*(spin+1)-desc[row]*desc[row-1])
-            sy[row, row-1] = (1j/2)*np.sqrt(spin*(spin+1)-desc[row]*desc[row-1])
-        else:
-            sx[row, row+1] = 1/2*np.sqrt(spin*(spin+1)-desc[row]*desc[row+1])
-            sx[row, row-1] = 1/2*np.sqrt(spin*(spin+1)-desc[row]*desc[row-1])
-            sy[row, row+1] = -(1j/2)*np.sqrt(spin*(spin+1)-desc[row]*desc[row+1])
-            sy[row, row-1] = (1j/2)*np.sqrt(spin*(spin+1)-desc[row]*desc[row-1])
-
-    return sx, sy, sz
+def lorentzian_peaks(E_grid, energies, amplitudes, fwhm, max_elements=2**22):
+    """ Sums Lorentzian peaks with a given FWHM centred at each of the energies
+    over E_grid. amplitudes has one row per peak and one column per series to
+    compute, so the output has dimensions len(E_grid) x amplitudes.shape[1]. 
+    The peaks are processed in chunks such that the len(E_grid) x chunk kernel
+    has at most max_elements entries. """
+    # Work in the precision of the peaks, e.g. float32 for a complex64 system
+    dtype = np.result_type(energies, amplitudes)
+    E_grid = np.asarray(E_grid, dtype=dtype)
+    peaks = np.zeros((len(E_grid), amplitudes.shape[1]), dtype=dtype)
+    chunk = max(1, max_elements // len(E_grid))
+    for start in range(0, len(energies), chunk):
+        kernel = (fwhm/2)**2 / ( (E_grid[:, None] - energies[None, start:start+chunk])**2 + (fwhm/2)**2 )
+        peaks += kernel @ amplitudes[start:start+chunk]
+    return peaks
 
 class Neighbour:
     def __init__(self, disp_vector, spinH, g_n_host, element):
-        self.disp_vector = 10**-10 * np.array(disp_vector)
-        self.R = np.linalg.norm(self.disp_vector)
+        self.set_vector(disp_vector)
         self.spinH = spinH
         self.multH = int(2*spinH+1)
         self.g_n_host = g_n_host
@@ -57,6 +41,11 @@ class Neighbour:
         self.H = np.array([self.Hx, self.Hy, self.Hz])
         self.Hv3 = self.H.reshape((3, self.multH**2))
 
+    def set_vector(self, disp_vector):
+        """ Sets the displacement vector (in Angstrom) of the neighbour. """
+        self.disp_vector = 10**-10 * np.array(disp_vector)
+        self.R = np.linalg.norm(self.disp_vector)
+
 class SpinSystem:
 
     mu_b = 9.2740100*10**-24 # Bohr Magneton (J/T)
@@ -71,14 +60,28 @@ class SpinSystem:
                           np.sin(theta) * np.sin(phi),    
                           np.cos(theta)])
 
-    def set_vector(self, disp_vector):
-        self.__init__(self.spinS, self.spinI, self.g_gs, self.g_es, self.A_gs, self.A_es, self.g_n_rei, self.g_n_host, self.spinH, disp_vector)
+    def set_vector(self, disp_vector, neigh_idx=0):
+        """ Moves the neighbour at neigh_idx to a new displacement vector. Only 
+        the SHF part of the Hamiltonian depends on it, so the rest of the 
+        precomputed operators are reused. Like a fresh system, the Hamiltonian
+        is reset to zero B field. """
+        self.neighbours[neigh_idx].set_vector(disp_vector)
+        self.update_SHF()
+        self.H0_gs = (self.HHF_gs + self.H_SHF_gs).astype(self.dtype)
+        self.H0_es = (self.HHF_es + self.H_SHF_es).astype(self.dtype)
+        self.reset_ham()
+        self.calc_energies()
 
-    def __init__(self, spinS, spinI, g_gs, g_es, A_gs, A_es, g_n_rei, neighbours_list):
+    def __init__(self, spinS, spinI, g_gs, g_es, A_gs, A_es, g_n_rei, neighbours_list, dtype=complex):
         # spinS = Electron spin, spinI = Nuclear spin, spinH = Nuclear spin of host atom
         self.spinS = spinS
         self.spinI = spinI
 
+        # Precision of the Hamiltonians and transition operators. np.complex64
+        # halves the memory traffic and is good enough for the transition 
+        # plots, but not for resolving the KHz superhyperfine splittings.
+        self.dtype = dtype
+
         # gs = ground state, es = excited state
         # g = electronic zeeman coefficients (3x3 matrix)
         # g_n = REI Nuclear g coefficient (isotropic)
@@ -112,12 +115,32 @@ class SpinSystem:
         self.neighbours = [Neighbour(*neigh) for neigh in self.neighbours_input]
         self.neighbours_string = "".join([neigh.element for neigh in self.neighbours])
 
+        # Dimensions of each subsystem in the order they appear in the tensor
+        # product: electron, REI nucleus, then each host nucleus.
+        self.dims = [self.multS, self.multI] + [neigh.multH for neigh in self.neighbours]
+        # Total dimension D of the tensor product space
+        self.dim = int(np.prod(self.dims))
+
         # Hamiltonian currently consists of only the hyperfine and SHF pieces 
         # since they are independent of the B field.
         self.initialize_HHF()
         self.initialize_SHF()
+        # The Zeeman terms are linear in B so their x, y, z components only 
+        # need to be built once and can be reused for every value of B.
+        self.initialize_zeeman_basis()
+        # Field independent part of the Hamiltonian, and the buffers that the 
+        # full Hamiltonian is written into on every B update
+        self.H0_gs = (self.HHF_gs + self.H_SHF_gs).astype(self.dtype)
+        self.H0_es = (self.HHF_es + self.H_SHF_es).astype(self.dtype)
+        self.H_gs = np.empty_like(self.H0_gs)
+        self.H_es = np.empty_like(self.H0_es)
         self.reset_ham()
 
+        # Transition operators for the 3 axes expanded into the full space, 
+        # which are field independent so we only compute them once.
+        self.bigS = np.array([expand_with_identities(2*s, *self.subsystem_dims(0)) for s in (self.sx, self.sy, self.sz)], dtype=self.dtype)
+        self.bigSx, self.bigSy, self.bigSz = self.bigS
+
         # # Update list of energy levels for each state
         self.calc_energies()
 
@@ -125,92 +148,123 @@ class SpinSystem:
         """ Sets the Hamiltonian to consist of only the field independent hyperfine 
         and superhyperfine parts. """
 
-        self.H_gs = copy.deepcopy(self.HHF_gs + self.H_SHF_gs)
-        self.H_es = copy.deepcopy(self.HHF_es + self.H_SHF_es)
+        np.copyto(self.H_gs, self.H0_gs)
+        np.copyto(self.H_es, self.H0_es)
+
+    def subsystem_dims(self, k):
+        """ Returns the total dimensions of the subsystems to the left and to
+        the right of the k-th subsystem in the tensor product. """
+        return int(np.prod(self.dims[:k])), int(np.prod(self.dims[k+1:]))
 
     def initialize_HHF(self):
         # Compute the hyperfine Hamiltonian by I @ A @ S for the ground state
-        # Reshape S from a column matrix of 3 multS x multS matrices to become 3 rows and multS^2 columns
-        # This lets to dot with A which is a 3x3 matrix. We then immediately reshape back.
-        # Then we take the dot product with I by kronecker product componentwise and sum.
-        self.HHF_gs = (self.A_gs @ self.Sv3).reshape((3, self.multS, self.multS))
-        self.HHF_gs = sum(np.kron(self.I[i], self.HHF_gs[i]) for i in range(3))
+        # This is sum_ij A_ij kron(I_i, S_j), which we do as a single contraction
+        # where the output indices acbd are the row and column indices of the
+        # Kronecker product, then reshape into a square matrix.
+        I = self.I.reshape((3, self.multI, self.multI))
+        S = self.S.reshape((3, self.multS, self.multS))
+        dim = self.multI * self.multS
+        self.HHF_gs = np.einsum('ij,iab,jcd->acbd', self.A_gs, I, S, optimize=True).reshape((dim, dim))
 
         # Expand into the host nucleus space
-        for neigh in self.neighbours: 
-            self.HHF_gs = np.kron(self.HHF_gs, np.identity(neigh.multH))
+        _, host_dim = self.subsystem_dims(1)
+        self.HHF_gs = expand_with_identities(self.HHF_gs, 1, host_dim)
 
         # Repeat for the excited state
-        self.HHF_es = (self.A_es @ self.Sv3).reshape((3, self.multS, self.multS))
-        self.HHF_es = sum(np.kron(self.I[i], self.HHF_es[i]) for i in range(3))
+        self.HHF_es = np.einsum('ij,iab,jcd->acbd', self.A_es, I, S, optimize=True).reshape((dim, dim))
         # Expand into the host nucleus space
-        for neigh in self.neighbours: 
-            self.HHF_es = np.kron(self.HHF_es, np.identity(neigh.multH))
+        self.HHF_es = expand_with_identities(self.HHF_es, 1, host_dim)
 
     def initialize_SHF(self):
         # mu = mu_b * g * S
         # Use v3 so that we can take the product with the 3x3 g matrix
         # Then reshape so that we get back our column 3 x (multS x multS) 
-        mu_REI_gs = -(self.mu_b * self.g_gs @ self.Sv3).reshape((3, self.multS, self.multS)) 
-        mu_REI_es = -(self.mu_b * self.g_es @ self.Sv3).reshape((3, self.multS, self.multS))
-        # Reshape both back to v3 since we need another dot product, this time with R
-        mu_REI_gs_v3 = mu_REI_gs.reshape((3, self.multS**2))
-        mu_REI_es_v3 = mu_REI_es.reshape((3, self.multS**2))
-
-        # First term is (mu_REI)dot(mu_host)/R^3
-        first_term_gs = 0
-        first_term_es = 0
-        # Second term is 3(mu_REI dot R)(mu_host dot R)/R^5
-        second_term_gs = 0
-        second_term_es = 0
+        self.mu_REI_gs = -(self.mu_b * self.g_gs @ self.Sv3).reshape((3, self.multS, self.multS)) 
+        self.mu_REI_es = -(self.mu_b * self.g_es @ self.Sv3).reshape((3, self.multS, self.multS))
 
-        for neigh_idx, neigh in enumerate(self.neighbours):
+        # Magnetic moments of the host nuclei
+        self.mu_hosts = [self.mu_n * neigh.g_n_host * neigh.H for neigh in self.neighbours]
 
-            mu_host = self.mu_n * neigh.g_n_host * neigh.H
-            # Reshape back to v3 since we need another dot product later with R
-            mu_host_v3 = mu_host.reshape((3, neigh.multH**2))
+        # Identities for the REI nuclear space + spectator host nuclei before
+        # each neighbour, and the spectator host nuclei after it
+        self.SHF_dims = [(int(np.prod(self.dims[1:2+neigh_idx])), self.subsystem_dims(2 + neigh_idx)[1]) 
+                         for neigh_idx in range(len(self.neighbours))]
 
-            # Do the dot product of mu_REI dot mu_host but with intervening identities
-            # for the REI nuclear space + spectator host nuclei
-            for i in range(3):
-                gs_term = np.kron(mu_REI_gs[i], np.identity(self.multI))
-                es_term = np.kron(mu_REI_es[i], np.identity(self.multI))
-
-                for inner_neigh_idx, inner_neigh in enumerate(self.neighbours):
-                    if inner_neigh_idx == neigh_idx:
-                        gs_term = np.kron(gs_term, mu_host[i])
-                        es_term = np.kron(es_term, mu_host[i])
-                    else:
-                        gs_term = np.kron(gs_term, np.identity(inner_neigh.multH))
-                        es_term = np.kron(es_term, np.identity(inner_neigh.multH))
-
-                first_term_gs += gs_term / neigh.R**3
-                first_term_es += es_term / neigh.R**3
-
-            # Take the dot product then reshape back
-            dot_REI_gs = neigh.disp_vector.dot(mu_REI_gs_v3).reshape((self.multS, self.multS))
-            dot_REI_es = neigh.disp_vector.dot(mu_REI_es_v3).reshape((self.multS, self.multS))
-            dot_host = neigh.disp_vector.dot(mu_host_v3).reshape((neigh.multH, neigh.multH))
-            # Expand into the REI nuclear space first
-            dot_REI_gs = np.kron(dot_REI_gs, np.identity(self.multI))
-            dot_REI_es = np.kron(dot_REI_es, np.identity(self.multI))
-
-            # Second term is 3(mu_REI dot R)(mu_host dot R)/R^5
-            for inner_neigh_idx, inner_neigh in enumerate(self.neighbours):
-                if inner_neigh_idx == neigh_idx:
-                    dot_REI_gs = np.kron(dot_REI_gs, dot_host)
-                    dot_REI_es = np.kron(dot_REI_es, dot_host)
-                else:
-                    dot_REI_gs = np.kron(dot_REI_gs, np.identity(inner_neigh.multH))
-                    dot_REI_es = np.kron(dot_REI_es, np.identity(inner_neigh.multH))
-
-            second_term_gs += (3/neigh.R**5) * dot_REI_gs
-            second_term_es += (3/neigh.R**5) * dot_REI_es
+        self.update_SHF()
+
+    def update_SHF(self):
+        """ Computes the SHF Hamiltonian from the magnetic moments cached by 
+        initialize_SHF and the current displacement vectors of the neighbours. """
+
+        H_SHF_gs = np.zeros((self.dim, self.dim), dtype=complex)
+        H_SHF_es = np.zeros((self.dim, self.dim), dtype=complex)
+
+        for neigh, mu_host, (before_dim, after_dim) in zip(self.neighbours, self.mu_hosts, self.SHF_dims):
+
+            # The interaction is mu_REI @ D @ mu_host with the dipole-dipole tensor
+            # D = I/R^3 - 3(R R^T)/R^5, i.e. the first term is (mu_REI)dot(mu_host)/R^3
+            # and the second term is 3(mu_REI dot R)(mu_host dot R)/R^5
+            dipole = np.identity(3) / neigh.R**3 - 3 * np.outer(neigh.disp_vector, neigh.disp_vector) / neigh.R**5
+
+            # Contract the 3 components to get the coefficients of the 
+            # multS x multS x multH x multH pair operator of the REI and host
+            coeffs_gs = np.einsum('ab,aij,bkl->ijkl', dipole, self.mu_REI_gs, mu_host, optimize=True)
+            coeffs_es = np.einsum('ab,aij,bkl->ijkl', dipole, self.mu_REI_es, mu_host, optimize=True)
+
+            add_pair_kron_identity(H_SHF_gs, coeffs_gs, before_dim, after_dim)
+            add_pair_kron_identity(H_SHF_es, coeffs_es, before_dim, after_dim)
 
         # Divide by the constant factor to convert from J to GHz
         # First 10**-7 comes from mu0/4pi
-        self.H_SHF_gs = 10**-7 * (first_term_gs - second_term_gs) / (self.h * 10**9)
-        self.H_SHF_es = 10**-7 * (first_term_es - second_term_es) / (self.h * 10**9)
+        self.H_SHF_gs = 10**-7 * H_SHF_gs / (self.h * 10**9)
+        self.H_SHF_es = 10**-7 * H_SHF_es / (self.h * 10**9)
+
+    def initialize_zeeman_basis(self):
+        """ Computes the x, y, z components of the Zeeman operators such that 
+        the Zeeman Hamiltonian is just the dot product of B with them, up to 
+        the factors of beta_el and beta_n. Since the operators are mostly
+        zeros, each is stored as a sparse 3 x D^2 matrix where every row is 
+        one flattened D x D component. """
+
+        # Electronic Zeeman operators g @ S for each state
+        O_el_gs = (self.g_gs @ self.Sv3).reshape((3, self.multS, self.multS))
+        O_el_es = (self.g_es @ self.Sv3).reshape((3, self.multS, self.multS))
+        # Each Zeeman term only acts on a single subsystem so we keep them as 
+        # (subsystem_index, small_matrix) pairs and expand them into the full
+        # space with sparse Kronecker products. There is no distinction between GS
+        # and ES for the nuclear terms, and we assume the nuclear g factors are
+        # isotropic scalars.
+        nuclear_terms = [(1, self.g_n_rei * self.I)]
+        for neigh_idx, neigh in enumerate(self.neighbours):
+            nuclear_terms.append((2 + neigh_idx, neigh.g_n_host * neigh.H))
+
+        def flattened_basis(terms):
+            # Sum the terms in the full space, then flatten each component
+            # into a row of a 3 x D^2 matrix
+            rows = []
+            for i in range(3):
+                op = sum(sparse_kron_identity(term[i], *self.subsystem_dims(k)) for k, term in terms)
+                rows.append(op.reshape((1, -1)))
+            return scipy.sparse.vstack(rows, format="csr")
+
+        self.O_el_gs = flattened_basis([(0, O_el_gs)])
+        self.O_el_es = flattened_basis([(0, O_el_es)])
+        # Sum of the REI and host nuclear Zeeman operators
+        self.O_n = flattened_basis(nuclear_terms)
+
+        # Total Zeeman operators for each state with the beta factors folded in.
+        # Minus for the nuclear terms since U = -mu.B but no minus for electron
+        # since the mu we calculated above is actually negative of what it
+        # really is. Updating B then only takes a single contraction per state.
+        self.O_gs = (self.beta_el * self.O_el_gs - self.beta_n * self.O_n).astype(self.dtype)
+        self.O_es = (self.beta_el * self.O_el_es - self.beta_n * self.O_n).astype(self.dtype)
+
+    def zeeman_contract(self, B_vecs, O):
+        """ Contracts the last axis (x, y, z) of B_vecs with a sparse 3 x D^2
+        Zeeman basis O and returns the dense D x D result(s). """
+        # Match the precision of O so the result is not upcast
+        B_vecs = np.asarray(B_vecs, dtype=np.finfo(O.dtype).dtype)
+        return (O.T @ B_vecs.T).T.reshape(B_vecs.shape[:-1] + (self.dim, self.dim))
 
     def update_zeeman_ham(self, B, B_theta, B_phi):
         """ Given a (new) value of the magnetic field, compute the new Zeeman
@@ -221,52 +275,13 @@ class SpinSystem:
                                 np.sin(B_theta) * np.sin(B_phi),    
                                 np.cos(B_theta)])
 
-        # Compute the electronic Zeeman Hamiltonian using beta * B @ g @ S
-        HZ_el_gs = (self.beta_el * B_vec @ self.g_gs @ self.Sv3).reshape((self.multS, self.multS))
-        HZ_el_es = (self.beta_el * B_vec @ self.g_es @ self.Sv3).reshape((self.multS, self.multS))
-        # Expand into the nuclear spin space
-        HZ_el_gs = np.kron(HZ_el_gs, np.identity(self.multI))
-        HZ_el_es = np.kron(HZ_el_es, np.identity(self.multI))
-        # Then expand into the superhyperfine nuclear spin space
-        for neigh in self.neighbours: 
-            HZ_el_gs = np.kron(HZ_el_gs, np.identity(neigh.multH))
-            HZ_el_es = np.kron(HZ_el_es, np.identity(neigh.multH))
-
-        # Do the same for the REI nuclear Zeeman Hamiltonian but there is no 
-        # distinction between GS and ES. We assume the nuclear g factor is an 
-        # isotropic scalar.
-        HZ_n_rei = (self.beta_n * self.g_n_rei * B_vec @ self.Iv3).reshape((self.multI, self.multI))
-        # Expand into the electronic spin space
-        HZ_n_rei = np.kron(np.identity(self.multS), HZ_n_rei)
-        # Expand into the superhyperfine nuclear spin space
-        for neigh in self.neighbours: 
-            HZ_n_rei = np.kron(HZ_n_rei, np.identity(neigh.multH))
-
-        # Do the same for the nuclear Zeeman Hamiltonian for the host nuclear spin
-        HZ_n_host = 0
-        for neigh_idx, neigh in enumerate(self.neighbours):
-            # Start with a blank template for the S and I spaces
-            HZ_n_host_accum = np.kron(np.identity(self.multS), np.identity(self.multI))
-            HZ_n_host_term = (self.beta_n * neigh.g_n_host * B_vec @ neigh.Hv3).reshape((neigh.multH, neigh.multH))
-
-            # Iterate through the neighbours and expand into their spaces
-            # When it's its own index we cross the actual Zeeman interaction instead
-            for inner_neigh_idx, inner_neigh in enumerate(self.neighbours):
-                if inner_neigh_idx == neigh_idx:
-                    HZ_n_host_accum = np.kron(HZ_n_host_accum, HZ_n_host_term)
-                else:
-                    HZ_n_host_accum = np.kron(HZ_n_host_accum, np.identity(inner_neigh.multH))
-
-            HZ_n_host += HZ_n_host_accum
-
         # Reset the Hamiltonian to be only the field-indep HF part and SHF part
         self.reset_ham()
-        # Add in the just-computed Zeeman terms
-        # Minus for the nuclear terms since U = -mu.B but no minus for electron
-        # since the mu we calculated above is actually negative of what it
-        # really is.
-        self.H_gs += (HZ_el_gs - HZ_n_rei - HZ_n_host)
-        self.H_es += (HZ_el_es - HZ_n_rei - HZ_n_host)
+        # Add in the Zeeman terms by contracting B with the x, y, z components
+        # of the precomputed total Zeeman operators. All additions are done in
+        # place on the preallocated Hamiltonians.
+        self.H_gs += self.zeeman_contract(B_vec, self.O_gs)
+        self.H_es += self.zeeman_contract(B_vec, self.O_es)
 
     def update_B(self, B, B_theta, B_phi):
         """ Updates the Zeeman Hamiltonian contribution from a newly
@@ -282,17 +297,50 @@ class SpinSystem:
     def calc_energies(self):
         """ Compute energies for the current Hamiltonian and updates state."""
 
-        # Get the ground state eigvals and eigvecs
-        eigval_gs, eigvec_gs = np.linalg.eig(self.H_gs)
-        # Sort the columns of the eigvecs in increasing size of the eigvals
-        self.E_gs = sorted(eigval_gs)
-        self.eigvec_gs = eigvec_gs[:, np.argsort(eigval_gs)]
+        # Get the ground state eigvals and eigvecs. The Hamiltonian is Hermitian
+        # so eigh gives real eigvals already sorted in increasing order, with
+        # the columns of the eigvecs in the same order.
+        self.E_gs, self.eigvec_gs = np.linalg.eigh(self.H_gs)
 
         # Do the same for the excited state
-        eigval_es, eigvec_es = np.linalg.eig(self.H_es)
-        # Sort the columns of the eigvecs in increasing size of the eigvals
-        self.E_es = sorted(eigval_es)
-        self.eigvec_es = eigvec_es[:, np.argsort(eigval_es)]
+        self.E_es, self.eigvec_es = np.linalg.eigh(self.H_es)
+
+    def hamiltonians_brange(self, B_range, B_theta, B_phi):
+        """ Returns the GS and ES Hamiltonians for every B in B_range stacked
+        along the first axis, i.e. with dimensions len(B_range) x D x D. """
+
+        # Cartesian B vectors for each B, dimensions len(B_range) x 3
+        B_vecs = np.outer(B_range, self.unit_vector(B_theta, B_phi))
+
+        # Same as update_zeeman_ham but contracting over a whole stack of B's
+        H_gs = self.H0_gs + self.zeeman_contract(B_vecs, self.O_gs)
+        H_es = self.H0_es + self.zeeman_contract(B_vecs, self.O_es)
+        return H_gs, H_es
+
+    def calc_energies_brange(self, B_range, B_theta, B_phi):
+        """ Computes the energies and eigvecs for every B in B_range using a 
+        single batched eigh call per state instead of one per B. Returns
+        (E_gs, eigvec_gs, E_es, eigvec_es) stacked along the first axis. """
+
+        H_gs, H_es = self.hamiltonians_brange(B_range, B_theta, B_phi)
+        E_gs, eigvec_gs = np.linalg.eigh(H_gs)
+        E_es, eigvec_es = np.linalg.eigh(H_es)
+        return E_gs, eigvec_gs, E_es, eigvec_es
+
+    def energies_brange(self, B_range, B_theta, B_phi, B_chunk=16):
+        """ Computes only the energies (no eigvecs) for every B in B_range. 
+        The B fields are diagonalised in batched chunks of B_chunk so that only
+        the Hamiltonians of one chunk are held at a time. Returns (E_gs, E_es)
+        with dimensions len(B_range) x D. """
+
+        B_range = np.asarray(B_range)
+        E_gs = np.zeros((len(B_range), self.dim), dtype=np.finfo(self.dtype).dtype)
+        E_es = np.zeros((len(B_range), self.dim), dtype=np.finfo(self.dtype).dtype)
+        for start in range(0, len(B_range), B_chunk):
+            H_gs, H_es = self.hamiltonians_brange(B_range[start:start+B_chunk], B_theta, B_phi)
+            E_gs[start:start+B_chunk] = np.linalg.eigvalsh(H_gs)
+            E_es[start:start+B_chunk] = np.linalg.eigvalsh(H_es)
+        return E_gs, E_es
 
     def energies(self, state, B=None, B_theta=None, B_phi=None):
         """ Returns energies of a system with the hyperfine interaction and 
@@ -318,17 +366,19 @@ class SpinSystem:
         if B is not None and B_theta is not None and B_phi is not None:
             self.update_B(B, B_theta, B_phi)
 
-        gs_transitions = []
-        es_transitions = []
-
-        for i in range(len(self.E_es)):
-            for j in range(i+1, len(self.E_gs)):
-                gs_transitions.append((self.E_gs[j]-self.E_gs[i], (1,1,1))) # 1 is a placeholder for the transition strength
-        for i in range(len(self.E_es)):
-            for j in range(i+1, len(self.E_es)):
-                es_transitions.append((self.E_es[j]-self.E_es[i], (1,1,1)))
+        # 1 is a placeholder for the transition strength
+        gs_transitions = [(energy, (1,1,1)) for energy in self.spin_transition_energies(self.E_gs)]
+        es_transitions = [(energy, (1,1,1)) for energy in self.spin_transition_energies(self.E_es)]
         return [gs_transitions, es_transitions]
 
+    def spin_transition_energies(self, E):
+        """ Returns the energy differences E[j] - E[i] for all i < j as an 
+        array, in the order of increasing i then increasing j. If E is a stack
+        of energies the differences are taken along the last axis. """
+        E = np.asarray(E)
+        i, j = np.triu_indices(E.shape[-1], k=1)
+        return E[..., j] - E[..., i]
+
     def optical_transitions(self, B=None, B_theta=None, B_phi=None, compute_strengths=False):
         """ Computes the transitions between the energy levels. Optional to
         provide a B field to update before computing. """
@@ -336,15 +386,27 @@ class SpinSystem:
         if B is not None and B_theta is not None and B_phi is not None:
             self.update_B(B, B_theta, B_phi)
 
-        transitions = []
+        energies, strengths = self.optical_transition_arrays(compute_strengths)
+        # Index pairs (idx_g, idx_e) in the same order as the arrays
+        pairs = itertools.product(range(len(self.E_gs)), range(len(self.E_es)))
+
+        if compute_strengths:
+            return [(energy, tuple(strength), pair) for energy, strength, pair in zip(energies, strengths, pairs)]
+        else:
+            return [(energy, None, pair) for energy, pair in zip(energies, pairs)]
 
-        for idx_g, e_g in enumerate(self.E_gs):
-            for idx_e, e_e in enumerate(self.E_es):
-                if compute_strengths:
-                    transitions.append((e_e-e_g, self.transition_strength(self.eigvec_gs[:, idx_g], self.eigvec_es[:, idx_e]), (idx_g, idx_e)))
-                else:
-                    transitions.append((e_e-e_g, None, (idx_g, idx_e)))
-        return transitions
+    def optical_transition_arrays(self, compute_strengths=False):
+        """ Returns the optical transition energies as a flat array ordered by
+        increasing ground state index and then excited state index, together
+        with a len(energies) x 3 array of their (fx, fy, fz) strengths (or None
+        if compute_strengths is False). """
+
+        energies = (np.asarray(self.E_es)[None, :] - np.asarray(self.E_gs)[:, None]).ravel()
+        if not compute_strengths:
+            return energies, None
+        # Strengths are indexed by [axis, es, gs] so move to [gs, es, axis]
+        strengths = self.transition_strength_matrix().transpose((2, 1, 0)).reshape((-1, 3))
+        return energies, strengths
 
     def superhyperfine_levels(self, state, B=None, B_theta=None, B_phi=None):
         """ Looks at the lower electronic zeeman branch of the ground state to 
@@ -385,10 +447,6 @@ class SpinSystem:
         if B is not None and B_theta is not None and B_phi is not None:
             self.update_B(B, B_theta, B_phi)
 
-        bigSx = 2*np.kron(np.kron(self.sx, np.identity(self.multI)), np.identity(self.multH))
-        bigSy = 2*np.kron(np.kron(self.sy, np.identity(self.multI)), np.identity(self.multH))
-        bigSz = 2*np.kron(np.kron(self.sz, np.identity(self.multI)), np.identity(self.multH))
-
         if stated_levels is None:
             gs_lower = self.eigvec_gs[:, 0]
             gs_upper = self.eigvec_gs[:, 1]
@@ -400,31 +458,40 @@ class SpinSystem:
             es_lower = self.eigvec_es[:, k]
 
         # Overlap while enclosing the Sx, Sy, Sz matrices
-        r_23_S_x = abs(gs_upper.conjugate() @ bigSx @ es_lower.T)**2
-        r_13_S_x = abs(gs_lower.conjugate() @ bigSx @ es_lower.T)**2
+        r_23_S_x = abs(gs_upper.conjugate() @ self.bigSx @ es_lower.T)**2
+        r_13_S_x = abs(gs_lower.conjugate() @ self.bigSx @ es_lower.T)**2
 
         RS_x = r_23_S_x / r_13_S_x
         rho_S_x = 4 * RS_x / (1 + RS_x)**2
 
         return r_23_S_x, r_13_S_x, RS_x, rho_S_x, gs_lower, gs_upper, es_lower
 
+    def transition_strength_matrix(self, eigvec_gs=None, eigvec_es=None):
+        """ Computes the transition strengths between every ground and excited
+        eigenvector for the 3 possible polarisation axes. Returns an array with
+        dimensions 3 x len(E_es) x len(E_gs) where entry [i, e, g] is the 
+        strength of the g -> e transition along axis i. Defaults to the current
+        eigvecs, but stacks of eigvecs (e.g. from calc_energies_brange) can be
+        given instead, in which case the leading stack axes are kept. """
+
+        if eigvec_gs is None:
+            eigvec_gs = self.eigvec_gs
+        if eigvec_es is None:
+            eigvec_es = self.eigvec_es
+
+        # All the matrix elements <e|bigS|g> for each axis as one matrix product,
+        # broadcasting over the axes of bigS and any stack axes of the eigvecs
+        eigvec_es_H = eigvec_es.conjugate().swapaxes(-1, -2)[..., None, :, :]
+        matrix_elements = eigvec_es_H @ self.bigS @ eigvec_gs[..., None, :, :]
+        return abs(matrix_elements) ** 2
+
     def transition_strength(self, initial, final):
         """ Computes the transition strength for two eigenvectors initial and
         final for the 3 possible polarisation axes. """
 
-        # Transition operator for the 3 axes (expanded into REI nuclear)
-        bigSx = 2*np.kron(self.sx, np.identity(self.multI))
-        bigSy = 2*np.kron(self.sy, np.identity(self.multI))
-        bigSz = 2*np.kron(self.sz, np.identity(self.multI))
-        # Expand into host spaces
-        for neigh in self.neighbours:
-            bigSx = np.kron(bigSx, np.identity(neigh.multH))
-            bigSy = np.kron(bigSy, np.identity(neigh.multH))
-            bigSz = np.kron(bigSz, np.identity(neigh.multH))
-        # Compute the mod square of the inner product
-        fx = abs(final.conjugate() @ bigSx @ initial) ** 2
-        fy = abs(final.conjugate() @ bigSy @ initial) ** 2
-        fz = abs(final.conjugate() @ bigSz @ initial) ** 2
+        # Compute the mod square of the inner product for all 3 axes at once
+        # using the precomputed transition operators
+        fx, fy, fz = abs(np.einsum('a,iab,b->i', final.conjugate(), self.bigS, initial, optimize=True)) ** 2
         return fx, fy, fz
 
 ############################
@@ -432,28 +499,84 @@ class SpinSystem:
     def plot_energies_brange(self, B_range, B_theta, B_phi):
         """ Plot all the energy levels of the system as a function of B field 
         strength. """
+        E_gs, E_es = self.energies_brange(B_range, B_theta, B_phi)
+
         plt.figure()
         plt.suptitle("Energy diagram as a function of B-field")
         plt.subplot(211)
-        plt.plot(B_range, [self.energies('es', b, B_theta, B_phi) for b in B_range])
+        plt.plot(B_range, E_es)
         plt.title("Excited state")
         plt.xlabel("B field / T")
         plt.ylabel("Energy / GHz")
         plt.subplot(212)
-        plt.plot(B_range, [self.energies('gs', b, B_theta, B_phi) for b in B_range])
+        plt.plot(B_range, E_gs)
         plt.title("Ground state")
         plt.ylabel("Energy / GHz")
 
+        # Leave the system in the state of the last B field as a sweep with
+        # update_B would
+        if len(B_range) > 0:
+            self.update_B(B_range[-1], B_theta, B_phi)
+
     def plot_optical_transitions(self, B_range, B_theta, B_phi):
         """ Plot all the optical transition energies as a function of B field. """
+        E_gs, E_es = self.energies_brange(B_range, B_theta, B_phi)
+        # Energies of all (gs, es) pairs in the same order as optical_transitions
+        transition_energies = (E_es[:, None, :] - E_gs[:, :, None]).reshape((len(B_range), self.dim**2))
+
         plt.figure()
-        # Take the 0-th component as the optical transitions function returns 
-        # (transition_energy, initial_state, final_state) as a tuple.
-        plt.plot(B_range, [[transition[0] for transition in self.optical_transitions(b, B_theta, B_phi)] for b in B_range])
+        plt.plot(B_range, transition_energies)
         plt.title("Optical Transitions between energy levels")
         plt.xlabel("B field / T")
         plt.ylabel("Transition Energy / GHz")
 
+        # Leave the system in the state of the last B field as a sweep with
+        # update_B would
+        if len(B_range) > 0:
+            self.update_B(B_range[-1], B_theta, B_phi)
+
+    def transition_spectrum_brange(self, B_range, B_theta, B_phi, transition_type, E_grid, fwhm, B_chunk=16):
+        """ Computes the spectrum of the transitions of transition_type 
+        ("optical", "spin_gs" or "spin_es") over E_grid for every B in B_range, 
+        where each transition is a Lorentzian peak with the given FWHM scaled 
+        by its strength. Returns an array with dimensions 
+        len(E_grid) x len(B_range) x 3 for E field parallel to each axis. 
+        The B fields are processed in chunks of B_chunk so that only the 
+        Hamiltonians, eigvecs and strengths of one chunk are held at a time. """
+
+        if transition_type not in ("optical", "spin_gs", "spin_es"):
+            raise Exception
+
+        peaks = np.zeros((len(E_grid), len(B_range), 3), dtype=np.finfo(self.dtype).dtype)
+
+        for start in range(0, len(B_range), B_chunk):
+            # Diagonalise the Hamiltonians for all the B fields in the chunk in one go
+            E_gs, eigvec_gs, E_es, eigvec_es = self.calc_energies_brange(B_range[start:start+B_chunk], B_theta, B_phi)
+
+            # Get the arrays of possible transition energies E_arr and their 
+            # (fx, fy, fz) strengths A_arr for every B in the chunk, where fx, 
+            # fy, fz refer to the transition strength for E field parallel to
+            # each of the 3 axes. Same ordering as optical_transition_arrays.
+            if transition_type == "optical":
+                E_arr = (E_es[:, None, :] - E_gs[:, :, None]).reshape((len(E_gs), -1))
+                A_arr = self.transition_strength_matrix(eigvec_gs, eigvec_es).transpose((0, 3, 2, 1)).reshape((len(E_gs), -1, 3))
+            else:
+                E_arr = self.spin_transition_energies(E_gs if transition_type == "spin_gs" else E_es)
+                # 1 is a placeholder for the transition strength
+                A_arr = np.broadcast_to(np.ones(3, dtype=E_arr.dtype), E_arr.shape + (3,))
+
+            # For each possible transition at the particular value of 
+            # B field, we take the transition energy and create a Lorentzian 
+            # peak around in the E_grid space, then scale it by its amplitude.
+            for chunk_idx in range(len(E_arr)):
+                peaks[:, start+chunk_idx] = lorentzian_peaks(E_grid, E_arr[chunk_idx], A_arr[chunk_idx], fwhm)
+
+        # Leave the system in the state of the last B field as a sweep with
+        # update_B would
+        if len(B_range) > 0:
+            self.update_B(B_range[-1], B_theta, B_phi)
+        return peaks
+
     def plot_transitions_strengths(self, B_range, B_theta, B_phi, transition_type, axis=None):
         """ Plot all the optical transition energies as a function of B field. 
         The colour of the line represents the strength of that transition. """
@@ -463,60 +586,16 @@ class SpinSystem:
             E_grid = np.arange(-10, 10, 0.001)
         else:
             E_grid = np.arange(0, 10, 0.001)
-        E_grid_size = len(E_grid)
-        B_grid_size = len(B_range)
+        # FWHM of the Lorentzian
+        fwhm = 0.1
 
+        peaks = self.transition_spectrum_brange(B_range, B_theta, B_phi, transition_type, E_grid, fwhm)
+
+        # We reverse the direction of each row since imshow by default plots from top to bottom
         if axis is None:
-            transition_grid_x = np.zeros((E_grid_size, B_grid_size))
-            transition_grid_y = np.zeros((E_grid_size, B_grid_size))
-            transition_grid_z = np.zeros((E_grid_size, B_grid_size))
+            transition_grid_x, transition_grid_y, transition_grid_z = np.moveaxis(np.exp(-5 * peaks[::-1]), 2, 0)
         else:
-            transition_grid = np.zeros((E_grid_size, B_grid_size))
-
-        for B_idx, B in enumerate(B_range):
-            # Update the B field and get the list of possible optical transitions
-            # as a list of (transition_energy, (fx, fy, fy)) tuples where
-            # fx, fy, fz refer to the transition strength for E field parallel
-            # to each of the 3 axes.
-            if transition_type == "optical":
-                transitions = self.optical_transitions(B, B_theta, B_phi, compute_strengths=True)
-            elif transition_type == "spin_gs":
-                transitions = self.spin_transitions(B, B_theta, B_phi, compute_strengths=True)[0]
-            elif transition_type == "spin_es":
-                transitions = self.spin_transitions(B, B_theta, B_phi, compute_strengths=True)[1]
-            else:
-                raise Exception
-            
-            if axis is None:
-                # Used to represent each column in the grid which we add each peak onto
-                grid_col_x = np.zeros(E_grid_size)
-                grid_col_y = np.zeros(E_grid_size)
-                grid_col_z = np.zeros(E_grid_size)
-            else:
-                grid_col = np.zeros(E_grid_size)
-
-            # For each possible optical transition at the particular value of 
-            # B field, we take the transition energy (0-th comp) and create a 
-            # Lorentzian peak around in the E_grid space, then scale it by its
-            # amplitude given by transition[1] (x,y,z) comps.
-            for transition in transitions:
-                # FWHM of the Lorentzian
-                fwhm = 0.1
-
-                if axis is None:
-                    grid_col_x += (fwhm/2)**2 * transition[1][0] / ( (E_grid - transition[0].real)**2 + (fwhm/2)**2 )
-                    grid_col_y += (fwhm/2)**2 * transition[1][1] / ( (E_grid - transition[0].real)**2 + (fwhm/2)**2 )
-                    grid_col_z += (fwhm/2)**2 * transition[1][2] / ( (E_grid - transition[0].real)**2 + (fwhm/2)**2 )
-                else:
-                    grid_col += (fwhm/2)**2 * transition[1][axis] / ( (E_grid - transition[0].real)**2 + (fwhm/2)**2 )
-                
-            if axis is None:
-                # We reverse the direction of each row since imshow by default plots from top to bottom
-                transition_grid_x[:, B_idx] = np.exp(-5 * grid_col_x[::-1])
-                transition_grid_y[:, B_idx] = np.exp(-5 * grid_col_y[::-1])
-                transition_grid_z[:, B_idx] = np.exp(-5 * grid_col_z[::-1])
-            else:
-                transition_grid[:, B_idx] = np.exp(-5 * grid_col[::-1])
+            transition_grid = np.exp(-5 * peaks[::-1, :, axis])
 
         # Plot a slice of the intensity at a particular value of B field
         # plt.plot(E_grid, transition_grid[:, 0][::-1])
@@ -553,33 +632,21 @@ class SpinSystem:
 
         # Array in energy space (GHz) at which to compute the transition strength
         E_grid = np.arange(-100, 100, 0.001)
-        E_grid_size = len(E_grid)
         # FWHM of the Lorentzian
         fwhm = 0.001
 
-        opt_trans = self.optical_transitions(B, B_theta, B_phi, compute_strengths=True)
+        self.update_B(B, B_theta, B_phi)
+        E_arr, A_arr = self.optical_transition_arrays(compute_strengths=True)
         plt.figure()
         
-        if axis is None:
-            # Used to represent each column in the grid which we add each peak onto
-            optical_peaks_x, optical_peaks_y, optical_peaks_z = np.zeros(E_grid_size), np.zeros(E_grid_size), np.zeros(E_grid_size)
-        else:
-            optical_peaks = np.zeros(E_grid_size)
-
         # For each possible optical transition at the particular value of 
-        # B field, we take the transition energy (0-th comp) and create a 
-        # Lorentzian peak around in the E_grid space, then scale it by its
-        # amplitude given by transition[1] (x,y,z) comps.
-        for idx, transition in enumerate(opt_trans):
-            print("{}/{}".format(idx, len(opt_trans)))
-            if axis is None:
-                optical_peaks_x += (fwhm/2)**2 * transition[1][0] / ( (E_grid - transition[0].real)**2 + (fwhm/2)**2 )
-                optical_peaks_y += (fwhm/2)**2 * transition[1][1] / ( (E_grid - transition[0].real)**2 + (fwhm/2)**2 )
-                optical_peaks_z += (fwhm/2)**2 * transition[1][2] / ( (E_grid - transition[0].real)**2 + (fwhm/2)**2 )
-            else:
-                optical_peaks += (fwhm/2)**2 * transition[1][axis] / ( (E_grid - transition[0].real)**2 + (fwhm/2)**2 )
+        # B field, we take the transition energy and create a Lorentzian peak
+        # around in the E_grid space, then scale it by its (x,y,z) amplitudes.
 
-            # plt.annotate('Transition ({}, {})'.format(*transition[2]), xy=(transition[0], max(transition[1])))
+        if axis is None:
+            optical_peaks_x, optical_peaks_y, optical_peaks_z = lorentzian_peaks(E_grid, E_arr, A_arr, fwhm).T
+        else:
+            optical_peaks = lorentzian_peaks(E_grid, E_arr, A_arr[:, [axis]], fwhm)[:, 0]
             
         # Plot a slice of the intensity at a particular value of B field
         plt.title("Optical Transition Strengths with (B, B_theta, B_phi) = {0}".format((B, B_theta, B_phi)))
@@ -597,19 +664,26 @@ class SpinSystem:
 
     def plot_spin_transitions(self, B_range, B_theta, B_phi):
         """ Plot all the spin transition energies as a function of B field. """
+        E_gs, E_es = self.energies_brange(B_range, B_theta, B_phi)
+
         plt.figure()
         plt.suptitle("Spin Transitions within energy level")
         plt.subplot(211)
-        plt.plot(B_range, np.array([[transition[0] for transition in self.spin_transitions(b, B_theta, B_phi)[1]] for b in B_range]))
+        plt.plot(B_range, self.spin_transition_energies(E_es))
         plt.title("Excited State Transitions")
         plt.xlabel("B field / T")
         plt.ylabel("Transition Energy / GHz")
         plt.subplot(212)
-        plt.plot(B_range, np.array([[transition[0] for transition in self.spin_transitions(b, B_theta, B_phi)[0]] for b in B_range]))
+        plt.plot(B_range, self.spin_transition_energies(E_gs))
         plt.title("Ground State Transitions")
         plt.xlabel("B field / T")
         plt.ylabel("Transition Energy / GHz")
 
+        # Leave the system in the state of the last B field as a sweep with
+        # update_B would
+        if len(B_range) > 0:
+            self.update_B(B_range[-1], B_theta, B_phi)
+
     def plot_superhyperfine(self, B_range, B_theta, B_phi):
         """ Plot the superhyperfine splitted levels for the lowest energy levels
         (i.e. plot the lowest 2 energy levels after incorporating the SHF
@@ -686,20 +760,10 @@ class SpinSystem:
         # the filesize from being too large)
         scaled_intensity_threshold = 10**-6 / num_inhomog_atoms
 
-        bigS_op_x = 2*np.kron(self.sx, np.identity(self.multI))
-        bigS_op_y = 2*np.kron(self.sy, np.identity(self.multI))
-        bigS_op_z = 2*np.kron(self.sz, np.identity(self.multI))
-        # Expand into neighbour space
-        for neigh in self.neighbours:
-            bigS_op_x = np.kron(bigS_op_x, np.identity(neigh.multH))
-            bigS_op_y = np.kron(bigS_op_y, np.identity(neigh.multH))
-            bigS_op_z = np.kron(bigS_op_z, np.identity(neigh.multH))
-
         # Set the axis for the E field polarisation to use the appropriate S matrix
         # for the transition probabilities
         axis_dict = {"x": 0, "y": 1, "z": 2}
-        bigS_op_dict = {"x": bigS_op_x, "y": bigS_op_y, "z": bigS_op_z} 
-        bigS_op_axis = bigS_op_dict[axis]
+        bigS_op_axis = self.bigS[axis_dict[axis]]
         
         # Used to store tuples of transitions in the system
         # Format: (gs_idx, es_idx, energy, intensity)
@@ -725,34 +789,24 @@ class SpinSystem:
         # Look at all possible transitions from all excited states to all
         # ground states which is used for the relaxation from excited->ground
         # state after pumping. Also used for the hole absorption strength.
+        # The strengths of all the pairs come from a single matrix product.
+        strengths = self.transition_strength_matrix()
+        blob_idx = np.ix_(es_blob, gs_blob)
+        cross_intensity_matrix[blob_idx] = strengths[axis_dict[axis]][blob_idx]
+        cross_intensity_matrix_allpol[blob_idx] = np.sum(strengths, axis=0)[blob_idx]
+
         for gs_idx in gs_blob:
-            gs_vec = self.eigvec_gs[:, gs_idx]
             for es_idx in es_blob:
-                es_vec = self.eigvec_es[:, es_idx]
-
-                intensity_x = abs(es_vec.conjugate() @ bigS_op_x @ gs_vec.T)**2
-                intensity_y = abs(es_vec.conjugate() @ bigS_op_y @ gs_vec.T)**2
-                intensity_z = abs(es_vec.conjugate() @ bigS_op_z @ gs_vec.T)**2
-                intensities = (intensity_x, intensity_y, intensity_z)
-
-                cross_intensity_matrix[es_idx][gs_idx] = intensities[axis_dict[axis]]
-                cross_intensity_matrix_allpol[es_idx][gs_idx] = sum(intensities)
-                cross_energies.append(((gs_idx, es_idx), (self.E_es[es_idx] - self.E_gs[gs_idx]).real))
+                cross_energies.append(((gs_idx, es_idx), self.E_es[es_idx] - self.E_gs[gs_idx]))
 
-                if intensities[axis_dict[axis]] > 10**-8:
+                if cross_intensity_matrix[es_idx][gs_idx] > 10**-8:
                     usable_transitions.append((gs_idx, es_idx))
 
         # Next look at all possible transitions within ground states. Used for
         # the relaxation of states with the burnt state due to population depletion.
-        # The matrix is symmetric so we only do on the upper half and just symmetrise.
-        for gs_lower_idx in range(len(gs_blob)):
-            gs_lower_vec = self.eigvec_gs[:, gs_blob[gs_lower_idx]]
-            # Remember to do the diagonal (upper==lower)!
-            for gs_upper_idx in range(gs_lower_idx, len(gs_blob)):
-                gs_upper_vec = self.eigvec_gs[:, gs_blob[gs_upper_idx]]
-                ground_intensity_matrix[gs_upper_idx][gs_lower_idx] = abs(gs_upper_vec.conjugate() @ bigS_op_axis @ gs_lower_vec.T)**2
-                # Symmetrise the matrix
-                ground_intensity_matrix[gs_lower_idx][gs_upper_idx] = ground_intensity_matrix[gs_upper_idx][gs_lower_idx]
+        # All the matrix elements between the blob states as one matrix product.
+        gs_blob_vecs = self.eigvec_gs[:, gs_blob]
+        ground_intensity_matrix[:len(gs_blob), :len(gs_blob)] = abs(gs_blob_vecs.conjugate().T @ bigS_op_axis @ gs_blob_vecs)**2
         print("Done!")
 
         # Normalise by row (i.e. sum of transition targets from each state = 1)
@@ -782,7 +836,7 @@ class SpinSystem:
             burn_transitions_list = []
 
             # Energy of the principal holeburning pumping transition
-            central_energy = (self.E_es[es_burn_idx] - self.E_gs[gs_burn_idx]).real
+            central_energy = self.E_es[es_burn_idx] - self.E_gs[gs_burn_idx]
             # Look at all possible transitions and find those that are nearby
             # in transition energy.           
             i = bisect.bisect_left(cross_energies_keys, central_energy - 2*10**-3)
@@ -850,7 +904,7 @@ class SpinSystem:
             # Create the holes for transitions starting from gs_burnt_set 
             for gs_idx in gs_burnt_set:
                 for es_idx in es_blob:
-                    energy = (self.E_es[es_idx] - self.E_gs[gs_idx] - central_energy).real
+                    energy = self.E_es[es_idx] - self.E_gs[gs_idx] - central_energy
                     intensity = cross_intensity_matrix[es_idx][gs_idx]
                     # Normalise with respect to the number of inhomog pairs we are looking at
                     intensity /= num_inhomog_atoms
@@ -868,7 +922,7 @@ class SpinSystem:
                 # been taken care off by the gs_populations list anyway)
                 if gs_idx in gs_burnt_set or gs_populations[gs_idx] == 0: 
                     continue
-                energy = (self.E_es[es_idx] - self.E_gs[gs_idx] - central_energy).real
+                energy = self.E_es[es_idx] - self.E_gs[gs_idx] - central_energy
                 # Scale by both the absorption strength and the population size
                 intensity = cross_intensity_matrix[es_idx][gs_idx] * gs_populations[gs_idx]
                 # Normalise with respect to the number of inhomog pairs we are looking at
@@ -0,0 +1,94 @@
+import functools
+import numpy as np
+import scipy.sparse
+
+# Helpers shared by the SpinSystem scripts for building spin operators and
+# tensor product operators without forming Kronecker products with identities.
+
+@functools.lru_cache(maxsize=16)
+def generate_spin_matrices(spin):
+    """ Generates the x, y, z spin matrices for an arbitrary spin. The results
+    are cached and returned as read-only arrays since they are shared between
+    all callers with the same spin. """
+    if spin == 0:
+        matrices = np.array((0,)), np.array((0,)), np.array((0,))
+    else:
+        # Generates a descending list from spin to -spin in steps of -1
+        desc = np.arange(spin, -spin-1, -1)
+
+        # Generate the spin matrices using the formula
+        # http://easyspin.org/documentation/spinoperators.html
+        # Only the first off-diagonals of sx and sy are nonzero
+        coeffs = 1/2 * np.sqrt(spin*(spin+1) - desc[:-1]*desc[1:])
+        sx = (np.diag(coeffs, 1) + np.diag(coeffs, -1)).astype(complex)
+        sy = -1j * np.diag(coeffs, 1) + 1j * np.diag(coeffs, -1)
+        sz = np.diag(desc).astype(complex)
+        matrices = sx, sy, sz
+
+    for matrix in matrices:
+        matrix.flags.writeable = False
+    return matrices
+
+def add_kron_identity(H, X, left_dim, right_dim):
+    """ Adds I_left (x) X (x) I_right onto H in place without ever forming the
+    Kronecker product. H is viewed as a (left, dimX, right, left, dimX, right)
+    tensor and X is written into the entries that are diagonal in the left and
+    right indices, which is exactly where the identities would place it. """
+    dim = X.shape[0]
+    H_view = H.reshape((left_dim, dim, right_dim, left_dim, dim, right_dim))
+    left = np.arange(left_dim)[:, None]
+    right = np.arange(right_dim)[None, :]
+    H_view[left, :, right, left, :, right] += X
+
+def add_pair_kron_identity(H, coeffs, mid_dim, right_dim):
+    """ Adds an interaction between the first subsystem (dimension dimA) and
+    another subsystem (dimension dimB) onto H in place, i.e.
+    sum_ijkl coeffs[i,j,k,l] |i><j| (x) I_mid (x) |k><l| (x) I_right,
+    using the same block diagonal trick as add_kron_identity. coeffs has
+    dimensions dimA x dimA x dimB x dimB. """
+    dimA, _, dimB, _ = coeffs.shape
+    H_view = H.reshape((dimA, mid_dim, dimB, right_dim, dimA, mid_dim, dimB, right_dim))
+    mid = np.arange(mid_dim)[:, None]
+    right = np.arange(right_dim)[None, :]
+    # The advanced indices get moved to the front, leaving the i, k, j, l axes
+    H_view[:, mid, :, right, :, mid, :, right] += coeffs.transpose((0, 2, 1, 3))
+
+def expand_with_identities(X, left_dim, right_dim):
+    """ Returns I_left (x) X (x) I_right as a new array, filling in only the
+    block diagonal positions instead of performing the Kronecker products. """
+    dim = left_dim * X.shape[0] * right_dim
+    out = np.zeros((dim, dim), dtype=X.dtype)
+    add_kron_identity(out, X, left_dim, right_dim)
+    return out
+
+def apply_kron_identity(X, psi, left_dim, right_dim):
+    """ Returns (I_left (x) X (x) I_right) @ psi without forming the operator.
+    psi is viewed as a (left, dimX, right) tensor so X only needs to be
+    contracted with its middle index. """
+    dim = X.shape[0]
+    psi_view = psi.reshape((left_dim, dim, right_dim))
+    return np.einsum('ij,ajb->aib', X, psi_view).reshape(psi.shape)
+
+def apply_pair_kron_identity(coeffs, psi, mid_dim, right_dim):
+    """ Returns the product of the pair interaction of add_pair_kron_identity
+    with psi without forming the operator, by viewing psi as a
+    (dimA, mid, dimB, right) tensor and contracting with coeffs directly. """
+    dimA, _, dimB, _ = coeffs.shape
+    psi_view = psi.reshape((dimA, mid_dim, dimB, right_dim))
+    return np.einsum('ijkl,jmlr->imkr', coeffs, psi_view, optimize=True).reshape(psi.shape)
+
+def sparse_kron_identity(X, left_dim, right_dim):
+    """ Returns I_left (x) X (x) I_right as a sparse CSR matrix built with
+    scipy.sparse.kron, so only the nonzero entries are ever stored. The cast
+    is needed since scipy.sparse.kron returns float64 for an all zero X. """
+    identity_left = scipy.sparse.identity(left_dim, dtype=X.dtype)
+    identity_right = scipy.sparse.identity(right_dim, dtype=X.dtype)
+    return scipy.sparse.kron(identity_left, scipy.sparse.kron(X, identity_right), format='csr').astype(X.dtype, copy=False)
+
+def sparse_pair_kron_identity(coeffs, mid_dim, right_dim):
+    """ Returns the pair interaction of add_pair_kron_identity as a sparse CSR
+    matrix. Block (i, j) of it is I_mid (x) coeffs[i,j] (x) I_right, so it is
+    assembled blockwise from sparse_kron_identity. """
+    dimA = coeffs.shape[0]
+    blocks = [[sparse_kron_identity(coeffs[i, j], mid_dim, right_dim) for j in range(dimA)] for i in range(dimA)]
+    return scipy.sparse.bmat(blocks, format='csr')